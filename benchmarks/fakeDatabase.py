@@ -0,0 +1,47 @@
+import collections
+from models.discordTwitchSubscription import DiscordTwitchSubscription
+
+# in-memory stand-in for DatabaseManager used by the load test
+# every call counts as one query, the loaders return the seeded subscriptions
+class FakeDatabase:
+
+    def __init__(self, subs):
+        self.subs = subs
+        self.calls = collections.Counter()
+
+    def queries(self):
+        return sum(self.calls.values())
+
+    async def loadStreamerSubs(self):
+        self.calls["loadStreamerSubs"] += 1
+        return [DiscordTwitchSubscription(sub.streamerId, sub.guildId, sub.channelId, sub.roleId, sub.message) for sub in self.subs]
+
+    async def loadActiveSubscriptions(self):
+        self.calls["loadActiveSubscriptions"] += 1
+        return []
+
+    async def loadLastStreamIds(self):
+        self.calls["loadLastStreamIds"] += 1
+        return []
+
+    async def getGlobalMods(self):
+        self.calls["getGlobalMods"] += 1
+        return []
+
+    async def loadOutbox(self):
+        self.calls["loadOutbox"] += 1
+        return []
+
+    async def loadGoLives(self):
+        self.calls["loadGoLives"] += 1
+        return []
+
+    async def getStreamerSubs(self, streamerId):
+        self.calls["getStreamerSubs"] += 1
+        return [sub for sub in self.subs if sub.streamerId == int(streamerId)]
+
+    # writes are only counted
+    def __getattr__(self, name):
+        async def write(*args):
+            self.calls[name] += 1
+        return write
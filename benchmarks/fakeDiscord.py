@@ -0,0 +1,102 @@
+import asyncio
+import collections
+import time
+
+# stand-in for the parts of the discord client the ping path uses
+# (get_guild, get_channel, guild.get_role, channel.send)
+# sends take latency seconds and are recorded with the time they completed
+# pings to one channel may be coalesced into one message, one ping per line, so
+# delivered pings are counted by lines rather than by sends
+# discord's rate limits are enforced the way discord.py experiences them: a send over
+# the limit counts as a 429 and waits for the bucket to free up before going through
+
+# discord's message limits: per channel and per bot
+CHANNEL_LIMIT = (5, 5.0)
+GLOBAL_LIMIT = (50, 1.0)
+
+class RateLimit:
+    def __init__(self, limit):
+        self.count, self.period = limit
+        self.sent = collections.deque()
+
+    # seconds until another message may be sent
+    def wait(self, now):
+        while self.sent and self.sent[0] <= now - self.period:
+            self.sent.popleft()
+        if len(self.sent) < self.count:
+            return 0
+        return self.sent[0] + self.period - now
+
+class FakeRole:
+    def __init__(self, id):
+        self.id = id
+        self.mention = "<@&%i>" % id
+
+class FakeChannel:
+    def __init__(self, client, id):
+        self.client = client
+        self.id = id
+        self.limit = RateLimit(CHANNEL_LIMIT)
+
+    async def send(self, text):
+        await self.client.request(self, text)
+
+class FakeGuild:
+    def __init__(self, id):
+        self.id = id
+        self.roles = {}
+
+    def get_role(self, id):
+        return self.roles.get(id)
+
+class FakeClient:
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.guilds = {}
+        self.channels = {}
+        self.globalLimit = RateLimit(GLOBAL_LIMIT)
+        # (channel id, text, completion epoch time)
+        self.sends = []
+        self.pings = 0
+        self.rateLimited = 0
+        self.allSent = asyncio.Event()
+        self.expected = None
+
+    def addGuild(self, guildId, channelIds, roleId):
+        guild = FakeGuild(guildId)
+        guild.roles[roleId] = FakeRole(roleId)
+        self.guilds[guildId] = guild
+        for channelId in channelIds:
+            self.channels[channelId] = FakeChannel(self, channelId)
+
+    def get_guild(self, id):
+        return self.guilds.get(id)
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    # sets the event once count more pings went through
+    def expect(self, count):
+        self.expected = self.pings + count
+        self.allSent.clear()
+
+    async def request(self, channel, text):
+        limited = False
+        while True:
+            now = time.monotonic()
+            wait = max(channel.limit.wait(now), self.globalLimit.wait(now))
+            if wait == 0:
+                break
+            limited = True
+            await asyncio.sleep(wait)
+        if limited:
+            self.rateLimited += 1
+        now = time.monotonic()
+        channel.limit.sent.append(now)
+        self.globalLimit.sent.append(now)
+        await asyncio.sleep(self.latency)
+        self.sends.append((channel.id, text, time.time()))
+        self.pings += text.count("\n") + 1
+        if self.expected is not None and self.pings >= self.expected:
+            self.allSent.set()
@@ -0,0 +1,243 @@
+import aiohttp
+import asyncio
+import collections
+import datetime
+import hashlib
+import hmac
+import json
+import time
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+import urllib.parse as urlp
+import uuid
+
+# stand-ins for the twitch endpoints the bot uses, served by a local tornado app:
+# the oauth token/validate endpoints, helix users and eventsub subscriptions
+# created webhook subscriptions are verified by sending a signed callback to their
+# callback url like twitch does, websocket subscriptions are enabled straight away
+# and live on the eventsub websocket at /ws (welcome, keepalives, session_reconnect)
+# goLive() sends a stream.online notification over the subscription's transport
+
+# the token the fake accepts for websocket subscriptions
+USER_TOKEN = "loadtest-user"
+
+def timestamp(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "000Z"
+
+class fakeHandler(tornado.web.RequestHandler):
+    def initialize(self, twitch):
+        self.twitch = twitch
+
+    def reply(self, status, data):
+        self.set_status(status)
+        self.set_header('Ratelimit-Remaining', '800')
+        self.set_header('Ratelimit-Reset', str(int(time.time()) + 60))
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps(data))
+
+class tokenHandler(fakeHandler):
+    def post(self):
+        self.twitch.requests["token"] += 1
+        if self.get_query_argument("grant_type") == "refresh_token":
+            self.reply(200, {"access_token": USER_TOKEN, "refresh_token": "loadtest-refresh", "expires_in": 14000, "token_type": "bearer"})
+            return
+        self.reply(200, {"access_token": "loadtest", "expires_in": 5000000, "token_type": "bearer"})
+
+class validateHandler(fakeHandler):
+    def get(self):
+        self.twitch.requests["validate"] += 1
+        self.reply(200, {"client_id": "loadtest", "expires_in": 5000000})
+
+class usersHandler(fakeHandler):
+    def get(self):
+        self.twitch.requests["users"] += 1
+        ids = self.get_query_arguments("id")
+        self.reply(200, {"data": [{"id": id, "login": "streamer%s" % id, "display_name": "Streamer%s" % id} for id in ids]})
+
+class subscriptionsHandler(fakeHandler):
+    def get(self):
+        self.twitch.requests["getSubscriptions"] += 1
+        subs = [self.twitch.publicSub(sub) for sub in self.twitch.subs.values()]
+        self.reply(200, {"data": subs, "total": len(subs), "pagination": {}})
+
+    def post(self):
+        self.twitch.requests["createSubscription"] += 1
+        payload = json.loads(self.request.body)
+        streamerId = payload['condition']['broadcaster_user_id']
+        if any(sub['condition']['broadcaster_user_id'] == streamerId for sub in self.twitch.subs.values()):
+            self.reply(409, {"error": "Conflict", "status": 409, "message": "subscription already exists"})
+            return
+        sub = {
+            "id": str(uuid.uuid4()),
+            "type": payload['type'],
+            "version": payload['version'],
+            "condition": payload['condition'],
+            "created_at": timestamp(time.time()),
+        }
+        if payload['transport']['method'] == "websocket":
+            # twitch refuses app tokens for websocket subscriptions
+            if self.request.headers.get("Authorization") != "Bearer " + USER_TOKEN:
+                self.reply(400, {"error": "Bad Request", "status": 400, "message": "websocket transports need a user access token"})
+                return
+            sessionId = payload['transport']['session_id']
+            if sessionId not in self.twitch.sockets:
+                self.reply(400, {"error": "Bad Request", "status": 400, "message": "websocket session does not exist"})
+                return
+            sub["status"] = "enabled"
+            sub["transport"] = {"method": "websocket", "session_id": sessionId}
+            self.twitch.subs[sub['id']] = sub
+            self.reply(202, {"data": [sub]})
+            return
+        sub["status"] = "webhook_callback_verification_pending"
+        sub["transport"] = {"method": "webhook", "callback": payload['transport']['callback']}
+        sub["secret"] = payload['transport']['secret']
+        self.twitch.subs[sub['id']] = sub
+        self.reply(202, {"data": [self.twitch.publicSub(sub)]})
+        asyncio.ensure_future(self.twitch.verify(sub))
+
+    def delete(self):
+        self.twitch.requests["deleteSubscription"] += 1
+        if self.twitch.subs.pop(self.get_query_argument("id"), None) is None:
+            self.set_status(404)
+        else:
+            self.set_status(204)
+
+# eventsub websocket, a connection with ?session=<id> takes over that session (reconnect)
+class socketHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, twitch):
+        self.twitch = twitch
+
+    def open(self):
+        self.sessionId = self.get_query_argument("session", None) or str(uuid.uuid4())
+        keepalive = int(self.get_query_argument("keepalive_timeout_seconds", 10))
+        previous = self.twitch.sockets.get(self.sessionId)
+        self.twitch.sockets[self.sessionId] = self
+        self.twitch.requests["socketConnect"] += 1
+        self.sendMessage("session_welcome", {"session": {"id": self.sessionId, "status": "connected", "keepalive_timeout_seconds": keepalive, "reconnect_url": None, "connected_at": timestamp(time.time())}})
+        # like twitch, the connection a session moved away from is closed once the new one is welcomed
+        if previous is not None:
+            previous.close()
+        # twitch sends a keepalive when it has sent nothing else for the timeout
+        self.keepalive = tornado.ioloop.PeriodicCallback(lambda: self.sendMessage("session_keepalive", {}), keepalive * 500)
+        self.keepalive.start()
+
+    def on_message(self, message):
+        pass
+
+    # a session ends with its last connection, and its subscriptions with it
+    def on_close(self):
+        self.keepalive.stop()
+        if self.twitch.sockets.get(self.sessionId) is self:
+            del self.twitch.sockets[self.sessionId]
+            for subId in [subId for subId, sub in self.twitch.subs.items() if sub['transport'].get('session_id') == self.sessionId]:
+                del self.twitch.subs[subId]
+
+    def sendMessage(self, messageType, payload, subscription=None):
+        metadata = {"message_id": str(uuid.uuid4()), "message_type": messageType, "message_timestamp": timestamp(time.time())}
+        if subscription:
+            metadata["subscription_type"] = subscription['type']
+            metadata["subscription_version"] = subscription['version']
+        self.write_message(json.dumps({"metadata": metadata, "payload": payload}))
+
+class FakeTwitch:
+
+    def __init__(self):
+        self.subs = {}
+        # session id -> socketHandler
+        self.sockets = {}
+        # ws:// url of /ws, for reconnect urls
+        self.socketUrl = None
+        self.requests = collections.Counter()
+        self.session = None
+        # seconds each notification took to be answered
+        self.webhookTimes = []
+        self.webhookStatus = collections.Counter()
+        self.verified = 0
+
+    def application(self):
+        args = {"twitch": self}
+        return tornado.web.Application([
+            (r"/oauth2/token", tokenHandler, args),
+            (r"/oauth2/validate", validateHandler, args),
+            (r"/helix/users", usersHandler, args),
+            (r"/helix/eventsub/subscriptions", subscriptionsHandler, args),
+            (r"/ws", socketHandler, args),
+        ])
+
+    # asks every websocket to move to a new connection, like twitch before maintenance
+    def reconnect(self):
+        for sessionId, socket in list(self.sockets.items()):
+            url = self.socketUrl + "?" + urlp.urlencode({"session": sessionId})
+            socket.sendMessage("session_reconnect", {"session": {"id": sessionId, "status": "reconnecting", "keepalive_timeout_seconds": None, "reconnect_url": url, "connected_at": timestamp(time.time())}})
+
+    def getSession(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    # posts a signed eventsub message to the subscription's callback
+    # returns (status, response text, seconds taken)
+    async def send(self, sub, messageType, body):
+        data = json.dumps(body).encode('utf-8')
+        messageId = str(uuid.uuid4())
+        sentAt = timestamp(time.time())
+        signature = hmac.new(sub['secret'].encode('utf-8'), messageId.encode('utf-8') + sentAt.encode('utf-8') + data, hashlib.sha256).hexdigest()
+        headers = {
+            "Content-Type": "application/json",
+            "Twitch-Eventsub-Message-Id": messageId,
+            "Twitch-Eventsub-Message-Timestamp": sentAt,
+            "Twitch-Eventsub-Message-Signature": "sha256=" + signature,
+            "Twitch-Eventsub-Message-Type": messageType,
+            "Twitch-Eventsub-Subscription-Type": sub['type'],
+            "Twitch-Eventsub-Subscription-Version": sub['version'],
+        }
+        start = time.perf_counter()
+        async with self.getSession().post(sub['transport']['callback'], data=data, headers=headers) as resp:
+            text = await resp.text()
+        return resp.status, text, time.perf_counter() - start
+
+    # a subscription as helix returns it, without the secret
+    def publicSub(self, sub):
+        return {key: value for key, value in sub.items() if key != "secret"}
+
+    # the callback must echo the challenge, retried since the bot may not have
+    # stored the pending subscription yet when the first attempt arrives
+    async def verify(self, sub):
+        challenge = uuid.uuid4().hex
+        for attempt in range(5):
+            await asyncio.sleep(0.05 * (attempt + 1))
+            status, text, _ = await self.send(sub, "webhook_callback_verification", {"challenge": challenge, "subscription": self.publicSub(sub)})
+            if status == 200 and text == challenge:
+                sub['status'] = "enabled"
+                self.verified += 1
+                return True
+        sub['status'] = "webhook_callback_verification_failed"
+        return False
+
+    # sends a stream.online notification for a streamer that started at startedAt (epoch)
+    async def goLive(self, streamerId, startedAt):
+        sub = next((sub for sub in self.subs.values() if sub['condition']['broadcaster_user_id'] == str(streamerId) and sub['status'] == "enabled"), None)
+        if sub is None:
+            self.webhookStatus["no subscription"] += 1
+            return
+        event = {
+            "id": str(uuid.uuid4().int % 10 ** 11),
+            "broadcaster_user_id": str(streamerId),
+            "broadcaster_user_login": "streamer%s" % streamerId,
+            "broadcaster_user_name": "Streamer%s" % streamerId,
+            "type": "live",
+            "started_at": timestamp(startedAt),
+        }
+        body = {"subscription": self.publicSub(sub), "event": event}
+        if sub['transport']['method'] == "websocket":
+            self.sockets[sub['transport']['session_id']].sendMessage("notification", body, sub)
+            self.webhookStatus["websocket"] += 1
+            return
+        status, _, elapsed = await self.send(sub, "notification", body)
+        self.webhookTimes.append(elapsed)
+        self.webhookStatus[status] += 1
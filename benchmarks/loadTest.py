@@ -0,0 +1,167 @@
+# offline load test of the go-live path, nothing leaves the machine:
+#   python benchmarks/loadTest.py --streamers 50 --guilds 200
+#   python benchmarks/loadTest.py --transport websocket --reconnect
+# the bot module is imported with its database, discord client and twitch endpoints
+# swapped for the stand-ins in this directory. every streamer subscribes through the
+# fake helix api (verified by a signed callback, or on the fake eventsub websocket
+# with --transport websocket), then all of them go live at once.
+# reports webhook response times, go-live to ping latency, database queries per
+# event and memory use. everything shares one event loop, so compare runs made on the
+# same machine rather than reading the numbers as absolute
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakeDatabase import FakeDatabase
+from fakeDiscord import FakeClient
+from fakeTwitch import FakeTwitch, USER_TOKEN
+from models.discordTwitchSubscription import DiscordTwitchSubscription
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+def describe(values):
+    if not values:
+        return "none"
+    return "p50 %.1fms, p99 %.1fms, max %.1fms" % (percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, max(values) * 1000)
+
+# streamer ids 1..N, every guild subscribes to every streamer
+# subscriptions are spread over the guild's channels
+def buildSubs(streamers, guilds, channels):
+    subs = []
+    layout = []
+    for g in range(guilds):
+        guildId = (g + 1) << 22
+        channelIds = [guildId + 1 + c for c in range(channels)]
+        roleId = guildId + 1000
+        layout.append((guildId, channelIds, roleId))
+        for s in range(streamers):
+            subs.append(DiscordTwitchSubscription(s + 1, guildId, channelIds[s % channels], roleId, "$role $link is live"))
+    return subs, layout
+
+async def waitFor(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("timed out waiting for " + what)
+        await asyncio.sleep(0.05)
+
+async def scenario(bot, args, twitch, discordClient, db):
+    streamers = list(range(1, args.streamers + 1))
+    await bot.index.load()
+    await bot.outbox.load()
+    await bot.replayGoLives()
+    bot.app.listen(args.port, address="127.0.0.1", max_body_size=bot.webhookMaxBody)
+    twitch.application().listen(args.twitch_port, address="127.0.0.1")
+    bot.webhookQueue.start()
+    bot.outbox.start()
+
+    # subscribe and let the fake twitch verify every subscription
+    # a websocket session subscribes everyone as soon as it is welcomed
+    setupStart = time.monotonic()
+    if args.transport == "websocket":
+        bot.eventsub.start()
+        subscribed = lambda: len(bot.eventsub.subs) == len(streamers)
+    else:
+        await bot.registerSubs(streamers)
+        subscribed = lambda: len(bot.index.activeSubs) == len(streamers)
+    await waitFor(subscribed, args.timeout, "subscriptions")
+    print("%i subscriptions ready in %.2fs" % (len(streamers), time.monotonic() - setupStart))
+    if args.reconnect:
+        twitch.reconnect()
+        await waitFor(lambda: twitch.requests["socketConnect"] == 2 and len(twitch.sockets) == 1, args.timeout, "websocket reconnect")
+        print("websocket moved to a new connection, %i subscriptions kept" % len(bot.eventsub.subs))
+
+    # everyone goes live at once, times are measured from the scenario start
+    queriesBefore = db.queries()
+    callsBefore = db.calls.copy()
+    helixBefore = twitch.requests.copy()
+    sendsBefore = len(discordClient.sends)
+    pingsBefore = discordClient.pings
+    expected = args.streamers * args.guilds
+    discordClient.expect(expected)
+    tracemalloc.reset_peak()
+    start = time.time()
+    await asyncio.gather(*[twitch.goLive(streamer, start) for streamer in streamers])
+    webhooksDone = time.time() - start
+    try:
+        await asyncio.wait_for(discordClient.allSent.wait(), args.timeout)
+    except asyncio.TimeoutError:
+        print("timed out with %i/%i pings sent" % (discordClient.pings - pingsBefore, expected))
+    # let background database writes finish
+    await asyncio.sleep(0.2)
+
+    sends = discordClient.sends[sendsBefore:]
+    latencies = [sentAt - start for _, _, sentAt in sends]
+    events = sum(twitch.webhookStatus.values())
+    queries = db.calls - callsBefore
+    current, peak = tracemalloc.get_traced_memory()
+    print("%i streamers x %i guilds (%i channels each): %i pings expected" % (args.streamers, args.guilds, args.channels, expected))
+    print("webhooks: %i answered in %.2fs, %s, status %s" % (events, webhooksDone, describe(twitch.webhookTimes), dict(twitch.webhookStatus)))
+    print("go-live to ping: %i pings in %i messages, first %.2fs, %s" % (discordClient.pings - pingsBefore, len(sends), min(latencies) if latencies else 0, describe(latencies)))
+    print("discord: %i sends rate limited" % discordClient.rateLimited)
+    print("database: %.2f queries per event %s" % ((db.queries() - queriesBefore) / max(events, 1), dict(queries)))
+    print("helix: %s during the go-live burst" % dict(twitch.requests - helixBefore))
+    print("memory: %.1fMB traced (peak %.1fMB during the burst), max rss %.1fMB" % (current / 2 ** 20, peak / 2 ** 20, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+    if bot.eventsub.task:
+        bot.eventsub.task.cancel()
+        await bot.eventsub.session.close()
+    await twitch.close()
+    await bot.twitchApi.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="offline load test of the go-live path")
+    parser.add_argument("--streamers", type=int, default=20)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--channels", type=int, default=1, help="notification channels per guild")
+    parser.add_argument("--transport", choices=("webhook", "websocket"), default="webhook", help="how the fake twitch sends notifications")
+    parser.add_argument("--reconnect", action="store_true", help="move the websocket to a new connection before going live")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="seconds each discord send takes")
+    parser.add_argument("--port", type=int, default=18080, help="port the bot's webhook listener uses")
+    parser.add_argument("--twitch-port", type=int, default=18081, help="port of the fake twitch api")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's info logging")
+    args = parser.parse_args()
+
+    os.environ.setdefault("TWITCH_ID", "loadtest")
+    os.environ.setdefault("TWITCH_SECRET", "loadtest")
+    tracemalloc.start()
+    import monkeysPing as bot
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    # import time settings come from .env, these override them for the run
+    os.environ["CALLBACK_URL"] = "http://127.0.0.1:%i/" % args.port
+    bot.workerCluster.workerCount = 1
+    twitchUrl = "http://127.0.0.1:%i" % args.twitch_port
+    bot.twitchApi.apiUrl = twitchUrl + "/helix"
+    bot.twitchApi.authUrl = twitchUrl + "/oauth2"
+    bot.eventsubTransport = args.transport
+    bot.userTokens.token = USER_TOKEN
+    bot.eventsub.url = "ws://127.0.0.1:%i/ws" % args.twitch_port
+
+    subs, layout = buildSubs(args.streamers, args.guilds, args.channels)
+    db = FakeDatabase(subs)
+    bot.db = db
+    bot.index.db = db
+    bot.outbox.db = db
+    discordClient = FakeClient(latency=args.discord_latency)
+    for guildId, channelIds, roleId in layout:
+        discordClient.addGuild(guildId, channelIds, roleId)
+    bot.client = discordClient
+
+    twitch = FakeTwitch()
+    twitch.socketUrl = bot.eventsub.url
+    asyncio.get_event_loop().run_until_complete(scenario(bot, args, twitch, discordClient, db))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# times the lookups DatabaseManager makes against the configured database
+# run it before and after applying the integer id/index migrations:
+#   python benchmarks/queryBenchmark.py          (before)
+#   yoyo apply
+#   python benchmarks/queryBenchmark.py          (after)
+# use a copy of production data, the numbers mean little on a near-empty database
+# only SELECTs are run, nothing is modified
+import argparse
+import dotenv
+import os
+import statistics
+import time
+from mysql.connector import connect
+
+# name, query, columns the parameters are read from ((table, column), ...)
+QUERIES = [
+    ("getStreamerSubs", "SELECT guildId, channelId, roleId, message FROM discordTwitchSubscriptions WHERE streamerId = %s", (("discordTwitchSubscriptions", "streamerId"),)),
+    ("findSubscription", "SELECT channelId, roleId FROM discordTwitchSubscriptions WHERE streamerId = %s AND guildId = %s", (("discordTwitchSubscriptions", "streamerId"), ("discordTwitchSubscriptions", "guildId"))),
+    ("getAllSubscriptions", "SELECT streamerId FROM discordTwitchSubscriptions WHERE guildId = %s", (("discordTwitchSubscriptions", "guildId"),)),
+    ("findActiveSubscription", "SELECT subscriptionId, streamerId, subSecret FROM activeSub WHERE streamerId = %s", (("activeSub", "streamerId"),)),
+    ("getLastStreamId", "SELECT streamId FROM lastLive WHERE streamerId = %s", (("lastLive", "streamerId"),)),
+]
+
+# parameters are passed with the column's own type so the "before" run
+# isn't penalized by an implicit cast the old code never did
+def columnIsNumeric(cursor, table, column):
+    cursor.execute("SELECT DATA_TYPE FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s", (table, column))
+    return cursor.fetchone()[0] in ("bigint", "int")
+
+# real rows to look up, so every query hits
+def sampleParams(cursor, query, columns, samples):
+    table = columns[0][0]
+    names = ", ".join(column for _, column in columns)
+    cursor.execute("SELECT %s FROM %s LIMIT %i" % (names, table, samples))
+    numeric = [columnIsNumeric(cursor, t, c) for t, c in columns]
+    return [tuple(int(v) if isNumeric else str(v) for v, isNumeric in zip(row, numeric)) for row in cursor.fetchall()]
+
+def explain(cursor, query, params):
+    cursor.execute("EXPLAIN " + query, params)
+    row = cursor.fetchone()
+    names = [d[0] for d in cursor.description]
+    cursor.fetchall()
+    return "type=%s key=%s rows=%s" % (row[names.index("type")], row[names.index("key")], row[names.index("rows")])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--samples", type=int, default=100)
+    args = parser.parse_args()
+
+    dotenv.load_dotenv(override=True)
+    connection = connect(
+        host="localhost",
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASS"),
+        database=os.getenv("DB_TABLE"),
+        autocommit=True)
+    cursor = connection.cursor()
+    prepared = connection.cursor(prepared=True)
+
+    print("%-24s %10s %10s %10s  %s" % ("query", "mean ms", "p50 ms", "p99 ms", "plan"))
+    for name, query, columns in QUERIES:
+        params = sampleParams(cursor, query, columns, args.samples)
+        if not params:
+            print("%-24s no rows to sample" % name)
+            continue
+        timings = []
+        for i in range(args.iterations):
+            start = time.perf_counter()
+            prepared.execute(query, params[i % len(params)])
+            prepared.fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print("%-24s %10.3f %10.3f %10.3f  %s" % (name, statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.99)], explain(cursor, query, params[0])))
+    connection.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import aiohttp
+import asyncio
+import logging
+import os
+
+# splits the bot over several worker processes (started by supervisor.py)
+# each worker runs the discord shards where shard % workerCount == workerIndex
+# worker 0 is the ingress: it receives the twitch webhooks, owns twitch subscription
+# registration and forwards pings to the worker owning each guild over a local http endpoint
+class Cluster:
+
+    def __init__(self):
+        self.workerCount = int(os.getenv("WORKER_COUNT", 1))
+        self.workerIndex = int(os.getenv("WORKER_INDEX", 0))
+        # 0 lets discord.py use a single (unsharded) connection
+        self.shardCount = int(os.getenv("SHARD_COUNT", 0))
+        # worker i listens on internalPort + i, localhost only
+        self.internalPort = int(os.getenv("INTERNAL_PORT", 8800))
+        # shared by the workers of one supervisor, sent with every internal request
+        self.secret = os.getenv("CLUSTER_SECRET", "")
+        self.session = None
+        if self.enabled and self.shardCount < self.workerCount:
+            raise ValueError("SHARD_COUNT (%i) must be at least WORKER_COUNT (%i)" % (self.shardCount, self.workerCount))
+
+    @property
+    def enabled(self):
+        return self.workerCount > 1
+
+    @property
+    def isIngress(self):
+        return self.workerIndex == 0
+
+    def ownedShards(self):
+        return [shard for shard in range(self.shardCount) if shard % self.workerCount == self.workerIndex]
+
+    # discord assigns guilds to shards by (guild id >> 22) % shard count
+    def workerForGuild(self, guildId):
+        if not self.enabled:
+            return self.workerIndex
+        return ((guildId >> 22) % self.shardCount) % self.workerCount
+
+    def getSession(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self.session
+
+    # sends a json payload to another worker's internal endpoint, returns True on success
+    async def post(self, worker, path, payload):
+        return await self.call(worker, path, payload) is not None
+
+    # like post, but returns the json response ({} if there is none) or None on failure
+    # timeout (seconds) replaces the default for endpoints that take longer
+    async def call(self, worker, path, payload, timeout=None):
+        url = "http://127.0.0.1:%i%s" % (self.internalPort + worker, path)
+        # passing timeout=None to aiohttp would turn the session's timeout off
+        options = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout else {}
+        try:
+            async with self.getSession().post(url, json=payload, headers={"Cluster-Secret": self.secret}, **options) as resp:
+                if resp.status >= 300:
+                    logging.error("worker %i %s returned %i" % (worker, path, resp.status))
+                    return None
+                if resp.content_type != 'application/json':
+                    return {}
+                return await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.error("worker %i %s failed: %s" % (worker, path, e))
+            return None
+
+    # sends a payload to every other worker
+    async def broadcast(self, path, payload):
+        if not self.enabled:
+            return
+        await asyncio.gather(*[self.post(worker, path, payload) for worker in range(self.workerCount) if worker != self.workerIndex])
@@ -0,0 +1,54 @@
+import collections
+import logging
+import time
+
+# dispatches chat commands through a table keyed on the command name
+# messages that don't start with the prefix are rejected with a single check,
+# the content is split once and handlers get the remaining fields as args
+class CommandRouter:
+
+    def __init__(self, privilegeOf, prefix="!"):
+        # privilegeOf(user, channel) returns the privilege level of a user
+        self.privilegeOf = privilegeOf
+        self.prefix = prefix
+        # command name -> (handler, required privilege)
+        self.commands = {}
+        # per command latency
+        self.calls = collections.Counter()
+        self.totalTime = collections.Counter()
+        self.maxTime = {}
+
+    # decorator registering handler(message, args) for a command
+    def command(self, name, privilege=0):
+        def register(handler):
+            self.commands[name] = (handler, privilege)
+            return handler
+        return register
+
+    async def dispatch(self, message):
+        if not message.content.startswith(self.prefix):
+            return
+        fields = message.content.split()
+        if fields[0] in self.commands:
+            await self.run(fields[0], message, fields[1:])
+
+    # runs a command for a message (or anything that looks like one)
+    # returns False if the author lacks the privilege for it
+    async def run(self, name, message, args):
+        handler, privilege = self.commands[name]
+        if privilege and self.privilegeOf(message.author, message.channel) < privilege:
+            return False
+        start = time.perf_counter()
+        try:
+            await handler(message, args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.calls[name] += 1
+            self.totalTime[name] += elapsed
+            self.maxTime[name] = max(self.maxTime.get(name, 0.0), elapsed)
+            logging.info("%s handled in %.3fs" % (name, elapsed))
+        return True
+
+    # returns [(command, calls, average seconds, max seconds)], most used first
+    def stats(self):
+        return [(name, calls, self.totalTime[name] / calls, self.maxTime[name]) for name, calls in self.calls.most_common()]
@@ -1,195 +1,267 @@
 from mysql.connector import connect
 from models.discordTwitchSubscription import DiscordTwitchSubscription
+from models.outboxPing import OutboxPing
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import metrics
 import os
+import threading
+import time
+
+# runs the decorated method on one of the database threads
+# so the blocking query never runs on the event loop
+# the time spent, including waiting for a free thread, is recorded per method
+def pooled(method):
+    @functools.wraps(method)
+    async def wrapper(self, *args):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self.executor, functools.partial(method, self, *args))
+        finally:
+            metrics.dbSeconds.observe(time.perf_counter() - start, method.__name__)
+    return wrapper
 
 class DatabaseManager:
 
-    def __init__(self):
-        self.connection = connect(
-        host="localhost",
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASS"),
-        database=os.getenv("DB_TABLE"))
+    def __init__(self, poolSize=None):
+        if poolSize is None:
+            poolSize = int(os.getenv("DB_POOL_SIZE", 4))
+        # each database thread owns one connection, so this is the connection pool
+        self.executor = ThreadPoolExecutor(max_workers=poolSize, thread_name_prefix="db")
+        self.local = threading.local()
+
+    # connection owned by the current database thread, opened on first use
+    def getConnection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = connect(
+            host="localhost",
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASS"),
+            database=os.getenv("DB_TABLE"),
+            autocommit=True)
+            self.local.connection = connection
+            self.local.statements = {}
+        elif not connection.is_connected():
+            connection.reconnect()
+            # prepared statements do not survive a reconnect
+            self.local.statements = {}
+        return connection
+
+    # prepared cursor for this query, prepared once per connection and then reused
+    def statement(self, query):
+        connection = self.getConnection()
+        cursor = self.local.statements.get(query)
+        if cursor is None:
+            cursor = connection.cursor(prepared=True)
+            self.local.statements[query] = cursor
+        return cursor
 
-    def maybeReconnect(self):
-        if self.connection.is_connected():
+    # runs a parameterized query, returns all rows (or None for statements without results)
+    def run(self, query, params=()):
+        cursor = self.statement(query)
+        cursor.execute(query, params)
+        if cursor.with_rows:
+            return cursor.fetchall()
+        return None
+
+    # runs a parameterized statement once per row of params, all in one transaction
+    def runMany(self, query, rows):
+        if not rows:
             return
-        self.connection.reconnect()
+        connection = self.getConnection()
+        cursor = self.statement(query)
+        connection.start_transaction()
+        try:
+            cursor.executemany(query, rows)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
 
+    @pooled
     def getStreamerSubs(self, streamerId):
-        self.maybeReconnect()
-        query = "SELECT guildId, channelId, roleId, message FROM discordTwitchSubscriptions WHERE streamerId = " + str(streamerId)
+        query = "SELECT guildId, channelId, roleId, message FROM discordTwitchSubscriptions WHERE streamerId = %s"
         toReturn = []
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            for sub in cursor.fetchall():
-                toReturn.append(DiscordTwitchSubscription(streamerId, sub[0], sub[1], sub[2], sub[3]))
-            self.connection.commit()
+        for sub in self.run(query, (int(streamerId),)):
+            toReturn.append(DiscordTwitchSubscription(streamerId, sub[0], sub[1], sub[2], sub[3]))
         return toReturn
 
+    @pooled
     def addStreamerSub(self, sub):
-        self.maybeReconnect()
-        query = "INSERT INTO discordTwitchSubscriptions (streamerId, guildId, channelId, roleId, message) VALUES (%i, %i, %i, %i, \"%s\")" % (sub.streamerId, sub.guildId, sub.channelId, sub.roleId, sub.message)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
+        query = "INSERT INTO discordTwitchSubscriptions (streamerId, guildId, channelId, roleId, message) VALUES (%s, %s, %s, %s, %s)"
+        self.run(query, (int(sub.streamerId), int(sub.guildId), int(sub.channelId), int(sub.roleId), sub.message))
 
+    @pooled
     def getAllStreamers(self):
-        self.maybeReconnect()
         query = "SELECT DISTINCT streamerId FROM discordTwitchSubscriptions"
         toReturn = []
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            for streamer in cursor.fetchall():
-                toReturn.append(streamer[0])
-            self.connection.commit()
+        for streamer in self.run(query):
+            toReturn.append(streamer[0])
         return toReturn
 
+    @pooled
     def findSubscription(self, streamerId, guildId):
-        self.maybeReconnect()
-        query = "SELECT channelId, roleId FROM discordTwitchSubscriptions WHERE streamerId = %s AND guildId = %s" % (streamerId, guildId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchall()
-            if result:
-                return result[0]
-            return None
-
-    def addActiveSubscription(self, subId, streamerId, subSecret):
-        self.maybeReconnect()
-        query = "INSERT INTO activeSub (subscriptionId, streamerId, subSecret) VALUES (\"%s\", %i, \"%s\")" % (subId, int(streamerId), subSecret)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
-
-    def editActiveSubscription(self, subId, streamerId, subSecret):
-        self.maybeReconnect()
-        query = "UPDATE activeSub SET subscriptionId = \"%s\", subSecret = \"%s\" WHERE streamerId = \"%s\"" % (str(subId), str(subSecret), str(streamerId))
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
-            
+        query = "SELECT channelId, roleId FROM discordTwitchSubscriptions WHERE streamerId = %s AND guildId = %s"
+        result = self.run(query, (int(streamerId), int(guildId)))
+        if result:
+            return result[0]
+        return None
+
+    # inserts the streamer's active subscription or replaces the existing one
+    @pooled
+    def setActiveSubscription(self, subId, streamerId, subSecret):
+        query = "INSERT INTO activeSub (subscriptionId, streamerId, subSecret) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE subscriptionId = VALUES(subscriptionId), subSecret = VALUES(subSecret)"
+        self.run(query, (str(subId), int(streamerId), str(subSecret)))
+
+    @pooled
     def getActiveSubscription(self, subId):
-        self.maybeReconnect()
-        query = "SELECT subscriptionId, streamerId, subSecret FROM activeSub WHERE subscriptionId = %s" % str(subId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            print(result)
-            if result:
-                return result
-            return None
-    
+        query = "SELECT subscriptionId, streamerId, subSecret FROM activeSub WHERE subscriptionId = %s"
+        result = self.run(query, (str(subId),))
+        if result:
+            return result[0]
+        return None
+
+    @pooled
     def findActiveSubscription(self, streamerId):
-        self.maybeReconnect()
-        query = "SELECT subscriptionId, streamerId, subSecret FROM activeSub WHERE streamerId = %s" % str(streamerId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            if result:
-                return result
-            return None
-    
+        query = "SELECT subscriptionId, streamerId, subSecret FROM activeSub WHERE streamerId = %s"
+        result = self.run(query, (int(streamerId),))
+        if result:
+            return result[0]
+        return None
+
+    @pooled
     def getAllActiveSubscriptions(self):
-        self.maybeReconnect()
         query = "SELECT DISTINCT streamerId FROM activeSub"
         toReturn = []
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            for sub in cursor.fetchall():
-                toReturn.append(sub)
-            return toReturn
-    
+        for sub in self.run(query):
+            toReturn.append(sub)
+        return toReturn
+
+    @pooled
+    def delActiveSubscription(self, subId):
+        query = "DELETE FROM activeSub WHERE subscriptionId = %s"
+        self.run(query, (str(subId),))
+
+    @pooled
+    def delActiveSubscriptions(self, subIds):
+        query = "DELETE FROM activeSub WHERE subscriptionId = %s"
+        self.runMany(query, [(str(subId),) for subId in subIds])
+
+    @pooled
     def clearActiveSubscriptions(self):
-        self.maybeReconnect()
         query = "TRUNCATE TABLE activeSub"
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
+        self.run(query)
 
+    @pooled
     def getLastStreamId(self, streamerId):
-        self.maybeReconnect()
-        query = "SELECT streamId FROM lastLive WHERE streamerId = %s" % str(streamerId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            if result:
-                return result[0]
-            return None
+        query = "SELECT streamId FROM lastLive WHERE streamerId = %s"
+        result = self.run(query, (int(streamerId),))
+        if result:
+            return result[0][0]
+        return None
 
+    @pooled
     def setLastStreamId(self, streamerId, streamId):
-        self.maybeReconnect()
-        query = "UPDATE lastLive SET streamId = %s WHERE streamerId = %s" % (str(streamId), str(streamerId))
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
-
-    def addLastStreamId(self, streamerId, streamId):
-        self.maybeReconnect()
-        query = "INSERT INTO lastLive (streamerId, streamId) VALUES (%s, %s)" % (str(streamerId), str(streamId))
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
-
-    def activeStreamerSubExists(self, streamerId):
-        self.maybeReconnect()
-        query = "SELECT COUNT(1) FROM activeSub WHERE streamerId = %s" % str(streamerId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            return result[0]
+        query = "INSERT INTO lastLive (streamerId, streamId) VALUES (%s, %s) ON DUPLICATE KEY UPDATE streamId = VALUES(streamId)"
+        self.run(query, (int(streamerId), int(streamId)))
 
+    @pooled
     def streamerExists(self, streamerId):
-        self.maybeReconnect()
-        query = "SELECT COUNT(1) FROM discordTwitchSubscriptions WHERE streamerId = %s" % str(streamerId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            result = cursor.fetchone()
-            return result[0]
-    
+        query = "SELECT COUNT(1) FROM discordTwitchSubscriptions WHERE streamerId = %s"
+        return self.run(query, (int(streamerId),))[0][0]
+
+    @pooled
     def delSubscription(self, streamerId, guildId):
-        self.maybeReconnect()
-        query = "DELETE FROM discordTwitchSubscriptions WHERE streamerId = %s AND guildId = %s" % (streamerId, guildId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
+        query = "DELETE FROM discordTwitchSubscriptions WHERE streamerId = %s AND guildId = %s"
+        self.run(query, (int(streamerId), int(guildId)))
 
+    @pooled
     def delAllSubscriptions(self, guildId):
-        self.maybeReconnect()
-        query = "DELETE FROM discordTwitchSubscriptions WHERE guildId = %s" % (guildId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
+        query = "DELETE FROM discordTwitchSubscriptions WHERE guildId = %s"
+        self.run(query, (int(guildId),))
 
+    @pooled
     def getAllSubscriptions(self, guildId):
-        self.maybeReconnect()
-        query = "SELECT streamerId FROM discordTwitchSubscriptions WHERE guildId = %s" % (guildId)
+        query = "SELECT streamerId FROM discordTwitchSubscriptions WHERE guildId = %s"
         toReturn = []
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            for streamer in cursor.fetchall():
-                toReturn.append(streamer)
-            return toReturn
-    
+        for streamer in self.run(query, (int(guildId),)):
+            toReturn.append(streamer)
+        return toReturn
+
+    @pooled
     def getGlobalMods(self):
-        self.maybeReconnect()
         query = "SELECT userId FROM globalMods"
         toReturn = []
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            for mod in cursor.fetchall():
-                toReturn.append(mod[0])
-            return toReturn
-    
+        for mod in self.run(query):
+            toReturn.append(mod[0])
+        return toReturn
+
+    @pooled
     def setPingMessage(self, guildId, streamerId, message):
-        self.maybeReconnect()
-        query = "UPDATE discordTwitchSubscriptions SET message = %s WHERE guildId = %s AND streamerId = %s" % (guildId, streamerId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
+        query = "UPDATE discordTwitchSubscriptions SET message = %s WHERE guildId = %s AND streamerId = %s"
+        self.run(query, (message, int(guildId), int(streamerId)))
 
+    @pooled
     def addGlobalMod(self, userId):
-        self.maybeReconnect()
-        query = "INSERT INTO globalMods (userId) VALUES (%s)" % str(userId)
-        with self.connection.cursor() as cursor:
-            cursor.execute(query)
-            self.connection.commit()
+        query = "INSERT INTO globalMods (userId) VALUES (%s)"
+        self.run(query, (int(userId),))
+
+    # bulk loaders used to build the in-memory subscription index at startup
+    @pooled
+    def loadStreamerSubs(self):
+        query = "SELECT streamerId, guildId, channelId, roleId, message FROM discordTwitchSubscriptions"
+        toReturn = []
+        for sub in self.run(query):
+            toReturn.append(DiscordTwitchSubscription(sub[0], sub[1], sub[2], sub[3], sub[4]))
+        return toReturn
+
+    @pooled
+    def loadActiveSubscriptions(self):
+        query = "SELECT subscriptionId, streamerId, subSecret FROM activeSub"
+        return self.run(query)
+
+    @pooled
+    def loadLastStreamIds(self):
+        query = "SELECT streamerId, streamId FROM lastLive"
+        return self.run(query)
+
+    # ping outbox, see pingOutbox.py
+    # a ping already in the outbox (same stream and guild) is left as is
+    @pooled
+    def addOutboxPings(self, pings):
+        query = "INSERT IGNORE INTO pingOutbox (streamId, guildId, channelId, message, link, mention, startedAt) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+        self.runMany(query, [(ping.streamId, ping.guildId, ping.channelId, ping.message, ping.link, ping.mention, ping.startedAt) for ping in pings])
+
+    # keys is a list of (stream id, guild id)
+    @pooled
+    def delOutboxPings(self, keys):
+        query = "DELETE FROM pingOutbox WHERE streamId = %s AND guildId = %s"
+        self.runMany(query, [(int(streamId), int(guildId)) for streamId, guildId in keys])
+
+    @pooled
+    def loadOutbox(self):
+        query = "SELECT streamId, guildId, channelId, message, link, mention, startedAt FROM pingOutbox"
+        toReturn = []
+        for ping in self.run(query):
+            toReturn.append(OutboxPing(*ping))
+        return toReturn
+
+    # go-lives whose pings are not stored yet, see goLive in monkeysPing.py
+    @pooled
+    def addGoLive(self, streamerId, streamId, startedAt):
+        query = "INSERT IGNORE INTO goLiveOutbox (streamerId, streamId, startedAt) VALUES (%s, %s, %s)"
+        self.run(query, (int(streamerId), int(streamId), float(startedAt)))
+
+    @pooled
+    def delGoLive(self, streamerId, streamId):
+        query = "DELETE FROM goLiveOutbox WHERE streamerId = %s AND streamId = %s"
+        self.run(query, (int(streamerId), int(streamId)))
+
+    # returns [(streamer id, stream id, startedAt)]
+    @pooled
+    def loadGoLives(self):
+        query = "SELECT streamerId, streamId, startedAt FROM goLiveOutbox"
+        return self.run(query)
@@ -0,0 +1,126 @@
+import aiohttp
+import asyncio
+import json
+import logging
+import metrics
+import urllib.parse as urlp
+
+# receives eventsub notifications over a websocket instead of webhooks
+# twitch opens every connection with a welcome message naming the session, subscriptions
+# are created for that session (see registerSub) and end with it. the connection is
+# considered dead when nothing (not even a keepalive) arrives within the keepalive
+# timeout, and is then replaced by a new session, which onSession(sessionId) has to
+# subscribe again. when twitch asks the bot to move (session_reconnect) the new
+# connection is opened before the old one is closed and the subscriptions carry over
+class EventSubSocket:
+
+    def __init__(self, url, onMessage, onSession, keepaliveTimeout=30):
+        self.url = url
+        # coroutine onMessage(message type, metadata, payload) handles notifications and revocations
+        self.onMessage = onMessage
+        self.onSession = onSession
+        # seconds twitch may go without sending anything (10-600)
+        self.keepaliveTimeout = keepaliveTimeout
+        self.sessionId = None
+        # streamer id -> id of the subscription created for this session
+        self.subs = {}
+        self.session = None
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    def getSession(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    # opens a connection and waits for its welcome, returns (websocket, session)
+    async def connect(self, url):
+        ws = await self.getSession().ws_connect(url)
+        try:
+            message = await self.receive(ws, 10)
+            if message['metadata']['message_type'] != 'session_welcome':
+                raise ConnectionError("expected session_welcome, got %s" % message['metadata']['message_type'])
+        except BaseException:
+            await ws.close()
+            raise
+        return ws, message['payload']['session']
+
+    # next message as a dict, raises ConnectionError if the connection closed
+    # and asyncio.TimeoutError if nothing arrived within timeout seconds
+    async def receive(self, ws, timeout):
+        msg = await ws.receive(timeout=timeout)
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            raise ConnectionError("eventsub websocket closed (%s %s)" % (msg.type.name, ws.close_code))
+        return json.loads(msg.data)
+
+    async def run(self):
+        backoff = 1
+        url = self.url
+        if self.keepaliveTimeout:
+            url += ("&" if "?" in url else "?") + urlp.urlencode({"keepalive_timeout_seconds": self.keepaliveTimeout})
+        while True:
+            try:
+                ws, session = await self.connect(url)
+                backoff = 1
+                await self.serve(ws, session)
+            except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError) as e:
+                logging.error("eventsub websocket failed: %s" % (str(e) or type(e).__name__))
+            except Exception:
+                logging.exception("eventsub websocket failed")
+            self.sessionId = None
+            self.subs.clear()
+            metrics.socketReconnects.inc("lost")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+    async def serve(self, ws, session):
+        self.sessionId = session['id']
+        logging.info("eventsub websocket session %s started" % self.sessionId)
+        # subscriptions have to be created within 10 seconds of the welcome
+        asyncio.ensure_future(self.onSession(self.sessionId))
+        keepalive = session['keepalive_timeout_seconds']
+        draining = None
+        try:
+            while True:
+                # a little grace on top of the keepalive timeout for network delay
+                message = await self.receive(ws, keepalive + 5)
+                if await self.handle(message) != 'session_reconnect':
+                    continue
+                # twitch keeps sending on the old connection until the new one is
+                # welcomed and then closes it, so it is read until then
+                if draining is not None:
+                    draining.cancel()
+                draining = asyncio.ensure_future(self.drain(ws, keepalive + 5))
+                ws, session = await self.connect(message['payload']['session']['reconnect_url'])
+                keepalive = session['keepalive_timeout_seconds']
+                metrics.socketReconnects.inc("requested")
+                logging.info("eventsub websocket session %s moved" % session['id'])
+        finally:
+            if draining is not None:
+                draining.cancel()
+            await ws.close()
+
+    # handles what is still sent on a connection being replaced, until twitch closes it
+    async def drain(self, ws, timeout):
+        try:
+            while True:
+                await self.handle(await self.receive(ws, timeout))
+        except (aiohttp.ClientError, ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            await ws.close()
+
+    # passes notifications and revocations to onMessage, returns the message type
+    async def handle(self, message):
+        messageType = message['metadata']['message_type']
+        metrics.socketMessages.inc(messageType)
+        if messageType.startswith('session_'):
+            return messageType
+        try:
+            await self.onMessage(messageType, message['metadata'], message['payload'])
+        except Exception:
+            logging.exception("handling eventsub %s failed" % messageType)
+        return messageType
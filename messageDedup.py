@@ -0,0 +1,44 @@
+import collections
+import time
+import twitchClient
+
+# remembers recently seen eventsub message ids to drop retried/replayed deliveries
+# messages older than the replay window are rejected outright, so ids only need
+# to be kept for that long - memory is further capped at maxSize entries
+class MessageDedup:
+
+    def __init__(self, maxSize=10000, window=600):
+        self.maxSize = maxSize
+        self.window = window
+        # message id -> time first seen, oldest first
+        self.seen = collections.OrderedDict()
+
+    # checks a Twitch-Eventsub-Message-Timestamp header against the replay window
+    def inWindow(self, timestamp):
+        if not timestamp:
+            return False
+        try:
+            sent = twitchClient.parseTimestamp(timestamp)
+        except ValueError:
+            return False
+        return abs(time.time() - sent) <= self.window
+
+    def expire(self, now):
+        while self.seen:
+            messageId, seenAt = next(iter(self.seen.items()))
+            if now - seenAt <= self.window and len(self.seen) <= self.maxSize:
+                return
+            self.seen.popitem(last=False)
+
+    # returns True if this message id was already seen, otherwise remembers it
+    def isDuplicate(self, messageId):
+        now = time.monotonic()
+        if messageId in self.seen:
+            return True
+        self.seen[messageId] = now
+        self.expire(now)
+        return False
+
+    # lets a message id through again, for messages twitch is asked to resend
+    def forget(self, messageId):
+        self.seen.pop(messageId, None)
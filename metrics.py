@@ -0,0 +1,120 @@
+import math
+
+# minimal prometheus style metrics, rendered in the text exposition format by render()
+# every metric created is added to the registry
+
+registry = []
+
+# latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def formatLabels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + "}"
+
+def formatValue(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelNames=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        registry.append(self)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s %s" % (self.name, self.type)]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help, labelNames=()):
+        super().__init__(name, help, labelNames)
+        # label values -> count
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        return ["%s%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(value)) for labels, value in self.values.items()]
+
+class Gauge(Metric):
+    type = "gauge"
+
+    # callback() is read at render time instead of set()
+    def __init__(self, name, help, labelNames=(), callback=None):
+        super().__init__(name, help, labelNames)
+        self.callback = callback
+        self.values = {}
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+    def samples(self):
+        if self.callback:
+            return ["%s %s" % (self.name, formatValue(self.callback()))]
+        return ["%s%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(value)) for labels, value in self.values.items()]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelNames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> [bucket counts, sum, count]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = [[0] * len(self.buckets), 0.0, 0]
+            self.values[labels] = entry
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        lines = []
+        for labels, (counts, total, count) in self.values.items():
+            for bound, bucketCount in zip(self.buckets, counts):
+                lines.append("%s_bucket%s %s" % (self.name, formatLabels(self.labelNames, labels, [("le", formatValue(bound))]), formatValue(bucketCount)))
+            lines.append("%s_sum%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(total)))
+            lines.append("%s_count%s %s" % (self.name, formatLabels(self.labelNames, labels), formatValue(count)))
+        return lines
+
+def render():
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+# ---------
+# metrics shared between modules
+# ---------
+
+webhookSeconds = Histogram("webhook_request_seconds", "Time spent handling a twitch webhook request", ("type",))
+signatureFailures = Counter("eventsub_signature_failures_total", "Webhook requests with a missing or wrong signature")
+duplicates = Counter("eventsub_duplicates_total", "Notifications dropped as duplicates", ("kind",))
+revocations = Counter("eventsub_revocations_total", "Twitch subscriptions revoked", ("reason",))
+socketMessages = Counter("eventsub_socket_messages_total", "Messages received on the eventsub websocket", ("type",))
+socketReconnects = Counter("eventsub_socket_reconnects_total", "Eventsub websocket reconnects, requested by twitch or after losing the connection", ("reason",))
+
+goLiveFirstPing = Histogram("golive_first_ping_seconds", "Time from stream start to the first ping delivered")
+goLiveLastPing = Histogram("golive_last_ping_seconds", "Time from stream start to the last ping delivered")
+
+dbSeconds = Histogram("db_query_seconds", "DatabaseManager call latency, including waiting for a connection", ("method",))
+twitchSeconds = Histogram("twitch_request_seconds", "Twitch api request latency", ("method", "path"))
+twitchRequests = Counter("twitch_requests_total", "Twitch api requests by response status", ("method", "path", "status"))
+discordSeconds = Histogram("discord_send_seconds", "Discord message send latency")
+discordSends = Counter("discord_sends_total", "Discord message sends by response status", ("status",))
+coalescedPings = Counter("pings_coalesced_total", "Pings merged into another message to the same channel")
+
+queueWait = Histogram("webhook_queue_wait_seconds", "Time queued webhook work waited for a worker")
@@ -0,0 +1,13 @@
+"""
+Unique activeSub streamer
+"""
+
+from yoyo import step
+
+__depends__ = {'20211002_02_ytxMO-create-table-activesub'}
+
+steps = [
+    # keep one row per streamer before adding the unique key
+    step("DELETE a FROM activeSub a JOIN activeSub b ON a.streamerId = b.streamerId AND a.subscriptionId < b.subscriptionId;"),
+    step("ALTER TABLE activeSub ADD UNIQUE KEY streamerId (streamerId);", "ALTER TABLE activeSub DROP KEY streamerId;"),
+]
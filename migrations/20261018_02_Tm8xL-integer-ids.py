@@ -0,0 +1,33 @@
+"""
+Integer ids
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_01_Rk3vQ-unique-activesub-streamer'}
+
+# twitch and discord ids are numeric, store them as BIGINT UNSIGNED
+# rows holding an id that can't be converted are dropped first, MODIFY then
+# rewrites each table casting the remaining values in place
+steps = [
+    step("DELETE FROM discordTwitchSubscriptions WHERE streamerId NOT REGEXP '^[0-9]+$' OR guildId NOT REGEXP '^[0-9]+$' OR channelId NOT REGEXP '^[0-9]+$' OR roleId NOT REGEXP '^[0-9]+$';"),
+    step(
+        "ALTER TABLE discordTwitchSubscriptions MODIFY streamerId BIGINT UNSIGNED NOT NULL, MODIFY guildId BIGINT UNSIGNED NOT NULL, MODIFY channelId BIGINT UNSIGNED NOT NULL, MODIFY roleId BIGINT UNSIGNED NOT NULL;",
+        "ALTER TABLE discordTwitchSubscriptions MODIFY streamerId VARCHAR(50), MODIFY guildId VARCHAR(50), MODIFY channelId VARCHAR(50), MODIFY roleId VARCHAR(50);",
+    ),
+    step("DELETE FROM lastLive WHERE streamerId NOT REGEXP '^[0-9]+$' OR streamId NOT REGEXP '^[0-9]+$';"),
+    step(
+        "ALTER TABLE lastLive MODIFY streamerId BIGINT UNSIGNED NOT NULL, MODIFY streamId BIGINT UNSIGNED NOT NULL;",
+        "ALTER TABLE lastLive MODIFY streamerId VARCHAR(50), MODIFY streamId VARCHAR(50);",
+    ),
+    step("DELETE FROM globalMods WHERE userId NOT REGEXP '^[0-9]+$';"),
+    step(
+        "ALTER TABLE globalMods MODIFY userId BIGINT UNSIGNED NOT NULL;",
+        "ALTER TABLE globalMods MODIFY userId VARCHAR(50);",
+    ),
+    step("DELETE FROM activeSub WHERE streamerId NOT REGEXP '^[0-9]+$';"),
+    step(
+        "ALTER TABLE activeSub MODIFY streamerId BIGINT UNSIGNED NOT NULL;",
+        "ALTER TABLE activeSub MODIFY streamerId VARCHAR(50);",
+    ),
+]
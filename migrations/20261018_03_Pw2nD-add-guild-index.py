@@ -0,0 +1,17 @@
+"""
+Add guild index
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_02_Tm8xL-integer-ids'}
+
+# getAllSubscriptions/delAllSubscriptions look subscriptions up by guild only,
+# which the (streamerId, guildId) primary key can't serve
+# activeSub lookups by streamer are covered by the unique key from 20261018_01
+steps = [
+    step(
+        "ALTER TABLE discordTwitchSubscriptions ADD KEY guildId (guildId);",
+        "ALTER TABLE discordTwitchSubscriptions DROP KEY guildId;",
+    ),
+]
@@ -0,0 +1,16 @@
+"""
+Create ping outbox
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_03_Pw2nD-add-guild-index'}
+
+# pings waiting to be delivered to discord, one row per subscription of a stream
+# rows are deleted once delivered and reloaded at startup
+steps = [
+    step(
+        "CREATE TABLE pingOutbox (streamId BIGINT UNSIGNED NOT NULL, guildId BIGINT UNSIGNED NOT NULL, channelId BIGINT UNSIGNED NOT NULL, message VARCHAR(2000) NOT NULL, link VARCHAR(100) NOT NULL, mention VARCHAR(50) NOT NULL, startedAt DOUBLE NOT NULL, PRIMARY KEY (streamId, guildId));",
+        "DROP TABLE pingOutbox;",
+    ),
+]
@@ -0,0 +1,17 @@
+"""
+Create go-live outbox
+"""
+
+from yoyo import step
+
+__depends__ = {'20261018_04_Xb7kQ-create-ping-outbox'}
+
+# go-lives acknowledged to twitch whose pings are not in pingOutbox yet
+# written before the notification is answered, deleted once the pings are stored
+# and replayed at startup
+steps = [
+    step(
+        "CREATE TABLE goLiveOutbox (streamerId BIGINT UNSIGNED NOT NULL, streamId BIGINT UNSIGNED NOT NULL, startedAt DOUBLE NOT NULL, PRIMARY KEY (streamerId, streamId));",
+        "DROP TABLE goLiveOutbox;",
+    ),
+]
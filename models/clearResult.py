@@ -0,0 +1,6 @@
+class ClearResult:
+    def __init__(self):
+        # twitch subscriptions (as returned by the api) by outcome
+        self.deleted = []
+        self.alreadyGone = []
+        self.failed = []
@@ -0,0 +1,14 @@
+class OutboxPing:
+    def __init__(self, streamId, guildId, channelId, message, link, mention, startedAt):
+        self.streamId = int(streamId)
+        self.guildId = int(guildId)
+        self.channelId = int(channelId)
+        self.message = message
+        self.link = link
+        self.mention = mention
+        self.startedAt = float(startedAt)
+
+    # one ping per subscription of a stream
+    @property
+    def key(self):
+        return (self.streamId, self.guildId)
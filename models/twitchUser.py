@@ -0,0 +1,5 @@
+class TwitchUser:
+    def __init__(self, id, login, display_name):
+        self.id = int(id)
+        self.login = login
+        self.display_name = display_name
@@ -1,21 +1,36 @@
 import dotenv
-import twitch
 import discord
 from discord.ext import tasks
 import asyncio
 import os
 import tornado.web
 import tornado
-import requests
 import logging
 import databaseManager
+import subscriptionIndex
+import twitchClient
+import pingFanout
+import pingOutbox
+import workQueue
+import messageDedup
+import pendingSubscriptions
+import userCache
+import reconciler
+import tokenManager
+import commandRouter
+import slashCommands
+import cluster
+import eventsubSocket
+import metrics
+import webhookSignature
 import models.discordTwitchSubscription
+import models.clearResult
+import models.outboxPing
 import hmac
-import hashlib
 import urllib.parse as urlp
 
-import string
-import random
+import secrets
+import time
 
 # load environment file
 dotenv.load_dotenv(override=True)
@@ -31,78 +46,258 @@ logging.basicConfig(
 # connect to database
 db = databaseManager.DatabaseManager()
 
-# load global moderators
-globalMods = db.getGlobalMods()
+# subscriptions, active twitch subscriptions and global moderators kept in memory
+# loaded at startup
+index = subscriptionIndex.SubscriptionIndex(db)
 
 # check signature
-def checkSig(request, secret):
-    # check signature
+# candidates is a list of (subscription id, secret) the request may be signed with
+# returns the one that signed it, None if none did
+def checkSig(request, candidates):
     sig = request.headers.get('Twitch-Eventsub-Message-Signature')
-    if (sig):
-        hmcMsg = request.headers.get('Twitch-Eventsub-Message-Id').encode('utf-8') + request.headers.get('Twitch-Eventsub-Message-Timestamp').encode('utf-8') + request.body
-        expectedSig = hmac.new(secret.encode('utf-8'), msg=hmcMsg, digestmod=hashlib.sha256).hexdigest()
-        if ("sha256=" + expectedSig != sig):
-            logging.info("incorrect notification signature!")
-            return False
-    else:
+    if (not sig):
         logging.info("notification unsigned!")
+        metrics.signatureFailures.inc()
+        return None
+    messageId = request.headers.get('Twitch-Eventsub-Message-Id')
+    timestamp = request.headers.get('Twitch-Eventsub-Message-Timestamp')
+    for subId, secret in candidates:
+        if (signatures.verify(secret, messageId, timestamp, request.body, sig)):
+            return subId, secret
+    logging.info("incorrect notification signature!")
+    metrics.signatureFailures.inc()
+    return None
+
+# (subscription id, secret) of a streamer's active and pending twitch subscriptions
+def streamerSecrets(streamerId):
+    activeSub = index.findActiveSubscription(streamerId)
+    return ([activeSub] if activeSub else []) + pendingSubs.forStreamer(streamerId)
+
+# handles a stream.online event from either transport
+# the go-live is saved before twitch gets its answer, a crash before its pings are
+# stored replays it at the next start (see replayGoLives)
+# returns False if it could not be saved or the work queue is full
+async def streamOnline(userId, event):
+    streamId = event['id']
+    # check if already seen this stream id
+    # indicates duplicate notification
+    previousStreamId = index.getLastStreamId(userId)
+    if (previousStreamId == str(streamId)):
+        logging.info("duplicate notification for streamer %s - not new live" % userId)
+        metrics.duplicates.inc("stream")
+        return True
+    # mark this as last stream seen live right away so a concurrent duplicate is caught
+    # saved by goLive once the pings are stored
+    index.markLive(userId, streamId)
+    startedAt = twitchClient.parseTimestamp(event['started_at'])
+    try:
+        await db.addGoLive(userId, streamId, startedAt)
+    except Exception:
+        logging.exception("could not save go-live of streamer %s" % userId)
+        index.unmarkLive(userId, streamId, previousStreamId)
+        return False
+    # queue pings to be sent after responding to twitch
+    # when the queue is full the saved go-live is left for twitch's retry (or the next start)
+    if (not webhookQueue.submit(goLive, userId, streamId, startedAt, previousStreamId)):
+        index.unmarkLive(userId, streamId, previousStreamId)
         return False
     return True
 
+# messages from the eventsub websocket (EVENTSUB_TRANSPORT=websocket)
+# nothing to verify, they arrive over the bot's own connection to twitch
+async def socketMessage(messageType, metadata, payload):
+    # twitch may send a message more than once
+    if (dedup.isDuplicate(metadata['message_id'])):
+        metrics.duplicates.inc("message")
+        return
+    sub = payload['subscription']
+    userId = int(sub['condition']['broadcaster_user_id'])
+    if (messageType == 'notification' and sub['type'] == 'stream.online'):
+        # twitch doesn't resend websocket messages, so a go-live that can't be saved or
+        # queued is lost
+        if (not await streamOnline(userId, payload['event'])):
+            logging.error("go-live of streamer %i dropped" % userId)
+    elif (messageType == 'revocation'):
+        metrics.revocations.inc(sub['status'])
+        logging.info("sub %s for streamer %s revoked: %s" % (sub['id'], userId, sub['status']))
+        if (eventsub.subs.get(userId) == sub['id']):
+            del eventsub.subs[userId]
+        if (index.streamerExists(userId) and sub['status'] != 'user_removed'):
+            webhookQueue.submit(registerSubs, [userId])
+
+# a new websocket session has no subscriptions, twitch closes it unless some are
+# created within 10 seconds
+async def socketSession(sessionId):
+    await registerSubs(index.getAllStreamers())
+
+# True if twitch sends go-lives of the streamer to the bot
+def hasSubscription(streamerId):
+    if (eventsubTransport == "websocket"):
+        return int(streamerId) in eventsub.subs
+    return index.findActiveSubscription(streamerId) is not None
+
+# eventsub webhook message types
+messageTypes = ('webhook_callback_verification', 'notification', 'revocation')
+
 # webserver class that will receive and handle http requests
 class listener(tornado.web.RequestHandler):
+    def prepare(self):
+        self.startTime = time.perf_counter()
+
+    # time every webhook request by message type, including rejected ones
+    # the header comes from anyone who can reach the callback, unknown types share one label
+    def on_finish(self):
+        messageType = self.request.headers.get('Twitch-Eventsub-Message-Type')
+        if (messageType not in messageTypes):
+            messageType = 'other'
+        metrics.webhookSeconds.observe(time.perf_counter() - self.startTime, messageType)
+
     # post requests - notifications received or subscription confirmations
+    # the body is only decoded once the signature checks out
     async def post(self):
-        # subscription confirmation
-        if (self.request.headers.get('Twitch-Eventsub-Message-Type') == 'webhook_callback_verification'):
-            # convert body to dictionary
-            body = tornado.escape.json_decode(self.request.body)
-            for pd, secret in pendingSubs:
-                if (pd['id'] != body['subscription']['id'] or pd['condition']['broadcaster_user_id'] != body['subscription']['condition']['broadcaster_user_id']):
-                    continue
-
-                # found the matching subscription
-                # check signature
-                if (checkSig(self.request, secret)):   
-                    
-                    # respond to the request
-                    self.write(body['challenge'])
-                    logging.info("Sub activated %s" % pd['condition']['broadcaster_user_id'])
-                    # remove from pending subs
-                    pendingSubs.remove((pd, secret))
-                    # add to active sub table
-                    if (db.activeStreamerSubExists(pd['condition']['broadcaster_user_id'])):
-                        db.editActiveSubscription(pd['id'], pd['condition']['broadcaster_user_id'], secret)
-                    else:
-                        db.addActiveSubscription(pd['id'], pd['condition']['broadcaster_user_id'], secret)
+        messageType = self.request.headers.get('Twitch-Eventsub-Message-Type')
+        if (messageType not in messageTypes):
+            self.set_status(400)
             return
+        # drop replays of old messages before doing any work
+        if (messageType != 'webhook_callback_verification' and not dedup.inWindow(self.request.headers.get('Twitch-Eventsub-Message-Timestamp'))):
+            logging.info("%s outside replay window" % messageType)
+            self.set_status(400)
+            return
+        # the callback url names the streamer (see registerSub) so the secret is known up front
+        # subscriptions registered before that only name the streamer in the body
+        body = None
+        streamer = self.get_query_argument('streamer', None)
+        # that body isn't verified yet, anything malformed is turned away cheaply
+        if (streamer is None):
+            try:
+                body = tornado.escape.json_decode(self.request.body)
+                streamer = str(body['subscription']['condition']['broadcaster_user_id'])
+            except (ValueError, KeyError, TypeError):
+                self.set_status(400)
+                return
+        if (not streamer.isdigit()):
+            self.set_status(400)
+            return
+        userId = int(streamer)
 
-        elif(self.request.headers.get('Twitch-Eventsub-Message-Type') == 'notification'):
-            # convert body to dictionary
-            body = tornado.escape.json_decode(self.request.body)
-
+        # check signature
+        match = checkSig(self.request, streamerSecrets(userId))
+        if (not match):
+            self.set_status(403)
+            return
+        subId, secret = match
+        try:
+            if (body is None):
+                body = tornado.escape.json_decode(self.request.body)
             sub = body['subscription']
+            matches = sub['id'] == subId and sub['condition']['broadcaster_user_id'] == str(userId)
+        except (ValueError, KeyError, TypeError):
+            logging.info("malformed %s for streamer %s" % (messageType, userId))
+            self.set_status(400)
+            return
+        if (not matches):
+            logging.info("message for sub %s signed with the secret of sub %s" % (sub['id'], subId))
+            self.set_status(400)
+            return
+
+        # subscription confirmation
+        if (messageType == 'webhook_callback_verification'):
+            if (not pendingSubs.get(subId)):
+                logging.info("verification for sub %s that is not pending" % subId)
+                return
+            # respond to the request before touching the database
+            self.finish(body['challenge'])
+            logging.info("Sub activated %s" % userId)
+            # add to active sub table, then remove from pending subs
+            # the secret stays in one of them throughout, so the reconciler keeps the sub
+            try:
+                await index.setActiveSubscription(subId, userId, secret)
+            finally:
+                pendingSubs.remove(subId)
+            return
+
+        elif(messageType == 'notification'):
+            activeSub = index.findActiveSubscription(userId)
+            if (not activeSub or activeSub[0] != subId):
+                logging.info("notification for streamer %s without an active subscription" % userId)
+                return
             if (sub['type'] == 'stream.online'):
-                userId = sub['condition']['broadcaster_user_id']
-                secret = db.findActiveSubscription(userId)[2]
-                # check signature
-                if (checkSig(self.request, secret)):
-                    logging.info(body)
-                    streamId = body['event']['id']
-                    # check if already seen this stream id
-                    # indicates duplicate notification
-                    lastStream = db.getLastStreamId(userId)
-                    if (lastStream == str(streamId)):
-                        logging.info("duplicate notification for streamer %s - not new live" % userId)
-                        return
-                    # mark this as last stream seen live
-                    if (lastStream == None):
-                        db.addLastStreamId(userId, streamId)
-                    else:
-                        db.setLastStreamId(userId, streamId)
-                    # send pings
-                    await sendPings(db.getStreamerSubs(userId))
+                # twitch retries deliveries with the same message id
+                messageId = self.request.headers.get('Twitch-Eventsub-Message-Id')
+                if (dedup.isDuplicate(messageId)):
+                    logging.info("duplicate message for streamer %s" % userId)
+                    metrics.duplicates.inc("message")
+                    self.set_status(204)
+                    return
+                # if it can't be saved or the queue is full let twitch retry later
+                # the retry has the same message id, so it must not count as seen
+                if (not await streamOnline(userId, body['event'])):
+                    dedup.forget(messageId)
+                    self.set_status(503)
+                    return
+                self.set_status(204)
+            return
+
+        # twitch revoked a subscription (user removed, too many failed deliveries etc)
+        # signed with the secret of either the active or a still pending subscription
+        elif(messageType == 'revocation'):
+            self.set_status(204)
+            self.finish()
+            if (dedup.isDuplicate(self.request.headers.get('Twitch-Eventsub-Message-Id'))):
                 return
+            metrics.revocations.inc(sub['status'])
+            logging.info("sub %s for streamer %s revoked: %s" % (subId, userId, sub['status']))
+            pendingSubs.remove(subId)
+            signatures.forget(secret)
+            await index.delActiveSubscription(subId, userId)
+            # re-register right away unless the streamer's account is gone
+            if (index.streamerExists(userId) and sub['status'] != 'user_removed'):
+                webhookQueue.submit(registerSubs, [userId])
+            return
+
+# prometheus scrape endpoint
+# if METRICS_TOKEN is set it must be sent as a bearer token
+class metricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        if (metricsToken and not hmac.compare_digest(self.request.headers.get('Authorization', ''), "Bearer " + metricsToken)):
+            raise tornado.web.HTTPError(401)
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(metrics.render())
+
+# internal endpoints other worker processes call (see cluster.py)
+class clusterHandler(tornado.web.RequestHandler):
+    def prepare(self):
+        if (not hmac.compare_digest(self.request.headers.get('Cluster-Secret', ''), workerCluster.secret)):
+            raise tornado.web.HTTPError(403)
+
+# pings for guilds owned by this worker, forwarded by the ingress worker
+# answered once the pings are in this worker's outbox
+class deliverHandler(clusterHandler):
+    async def post(self):
+        body = tornado.escape.json_decode(self.request.body)
+        subs = [models.discordTwitchSubscription.DiscordTwitchSubscription(body['streamerId'], *sub) for sub in body['subs']]
+        if (not await sendPings(subs, body['streamId'], body['startedAt'])):
+            self.set_status(503)
+
+# another worker changed subscriptions or global moderators in the database
+class syncHandler(clusterHandler):
+    async def post(self):
+        body = tornado.escape.json_decode(self.request.body)
+        for streamerId in body['streamers']:
+            await index.reloadStreamer(streamerId)
+        if (body['mods']):
+            await index.reloadGlobalMods()
+        # only the ingress worker registers with twitch
+        if (workerCluster.isIngress):
+            await registerSubs([streamerId for streamerId in body['streamers'] if index.streamerExists(streamerId) and not hasSubscription(streamerId)])
+
+# !reconcile sent to another worker
+class reconcileHandler(clusterHandler):
+    async def post(self):
+        if (not workerCluster.isIngress):
+            raise tornado.web.HTTPError(404)
+        self.write({"report": await reconcile()})
 
 # twitch dev details
 twitchId = os.getenv("TWITCH_ID")
@@ -111,82 +306,202 @@ twitchSecret = os.getenv("TWITCH_SECRET")
 # port
 port = os.getenv("TTV_PORT")
 
+# largest webhook body accepted, twitch's messages are a few kilobytes
+# bigger requests are refused while being read, before any signature check
+webhookMaxBody = int(os.getenv("WEBHOOK_MAX_BODY", 65536))
+
+# keyed hmacs for checking webhook signatures, one per subscription secret
+signatures = webhookSignature.SignatureVerifier(maxSize=int(os.getenv("SIGNATURE_CACHE_SIZE", 10000)))
+
+# optional token required to read /metrics
+metricsToken = os.getenv("METRICS_TOKEN")
+
 # default live message
 defaultMessage = os.getenv("DEFAULT_LIVE_MESSAGE")
 
+# times queued go-live pings that could not be stored are tried again
+goLiveRetries = int(os.getenv("GOLIVE_RETRIES", 3))
+
+# worker processes and discord shards (single process unless started by supervisor.py)
+workerCluster = cluster.Cluster()
+
 # variable for web server
-app = tornado.web.Application([(r"/", listener)])
+# only the ingress serves app, other workers expose their metrics on the local cluster port
+app = tornado.web.Application([(r"/", listener), (r"/metrics", metricsHandler)])
+clusterApp = tornado.web.Application([(r"/deliver", deliverHandler), (r"/sync", syncHandler), (r"/reconcile", reconcileHandler), (r"/metrics", metricsHandler)])
 
 # init discord client and twitch connection
+# commands are chat messages (!pingme), application commands (/pingme) or both
+# "slash" turns off message events so the bot no longer receives every message
+commandMode = os.getenv("COMMAND_MODE", "message")
 intents = discord.Intents.default()
-intents.message_content = True
-client = discord.Client(intents=intents)
-helix_api = twitch.Helix(twitchId, twitchSecret)
-
-# store twitch token once obtained
-# expires periodically - will be updated in background
-twitchToken = None
-
-# store pending twitch webhook subscriptions
-pendingSubs = []
+if (commandMode == "slash"):
+    intents.messages = False
+else:
+    intents.message_content = True
+if (workerCluster.shardCount):
+    client = discord.AutoShardedClient(intents=intents, shard_count=workerCluster.shardCount, shard_ids=workerCluster.ownedShards())
+else:
+    client = discord.Client(intents=intents)
+
+# shared non-blocking client for twitch api calls
+# twitch token expires periodically - will be updated in background
+twitchApi = twitchClient.TwitchClient(
+    twitchId,
+    apiUrl=os.getenv("TWITCH_API_URL", "https://api.twitch.tv/helix"),
+    authUrl=os.getenv("TWITCH_AUTH_URL", "https://id.twitch.tv/oauth2"),
+    timeout=int(os.getenv("TWITCH_TIMEOUT", 10)))
+twitchApi.tokens = tokenManager.TokenManager(twitchApi, twitchSecret)
+
+# how twitch delivers notifications: webhook (to CALLBACK_URL) or websocket
+# websocket subscriptions are created with a user token instead of the app token
+eventsubTransport = os.getenv("EVENTSUB_TRANSPORT", "webhook")
+userTokens = tokenManager.UserTokenManager(twitchApi, twitchSecret, os.getenv("TWITCH_USER_TOKEN"), os.getenv("TWITCH_USER_REFRESH_TOKEN"))
+eventsub = eventsubSocket.EventSubSocket(
+    os.getenv("EVENTSUB_WS_URL", "wss://eventsub.wss.twitch.tv/ws"),
+    socketMessage,
+    socketSession,
+    keepaliveTimeout=int(os.getenv("EVENTSUB_KEEPALIVE", 30)))
+
+# cached, batched twitch user lookups
+users = userCache.UserCache(twitchApi, maxSize=int(os.getenv("USER_CACHE_SIZE", 5000)))
+
+# webhook work is queued and handled by workers after responding to twitch
+webhookQueue = workQueue.WorkQueue(maxSize=int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000)), workers=int(os.getenv("WEBHOOK_WORKERS", 4)))
+
+# recently seen eventsub message ids
+dedup = messageDedup.MessageDedup(maxSize=int(os.getenv("DEDUP_CACHE_SIZE", 10000)))
+
+# concurrent, rate limited delivery of pings to discord channels
+fanout = pingFanout.PingFanout(maxConcurrent=int(os.getenv("PING_CONCURRENCY", 20)))
+
+# pings are stored until delivered, pings to the same channel within PING_COALESCE_MS
+# are sent as one message
+outbox = pingOutbox.PingOutbox(
+    db,
+    fanout,
+    lambda channelId: client.get_channel(channelId),
+    ownsGuild=lambda guildId: workerCluster.workerForGuild(guildId) == workerCluster.workerIndex,
+    window=int(os.getenv("PING_COALESCE_MS", 250)) / 1000)
+
+# number of twitch subscriptions registered at once
+registerConcurrency = int(os.getenv("REGISTER_CONCURRENCY", 10))
+
+# number of twitch subscriptions deleted at once
+clearConcurrency = int(os.getenv("CLEAR_CONCURRENCY", 10))
+
+# store pending twitch webhook subscriptions until twitch verifies them
+pendingSubs = pendingSubscriptions.PendingSubscriptions(maxSize=int(os.getenv("PENDING_SUBS_MAX", 10000)))
 
 # store ACTIVE (with the API) twitch webhook subscriptions
 # key is streamer id, value is subscription id
 activeSubs = []
 
+# gauges read when /metrics is scraped
+metrics.Gauge("pending_subscriptions", "Twitch subscriptions waiting for verification", callback=lambda: len(pendingSubs))
+metrics.Gauge("active_subscriptions", "Verified twitch subscriptions", callback=lambda: len(index.activeSubs))
+metrics.Gauge("outbox_pings", "Pings stored but not yet delivered", callback=lambda: len(outbox))
+metrics.Gauge("webhook_queue_depth", "Webhook jobs waiting for a worker", callback=lambda: webhookQueue.queue.qsize())
+
+# callback url of a streamer's twitch subscription: CALLBACK_URL with ?streamer=<id>
+def callbackUrl(streamer):
+    url = urlp.urlsplit(os.getenv("CALLBACK_URL"))
+    query = urlp.urlencode(urlp.parse_qsl(url.query) + [("streamer", str(streamer))])
+    return urlp.urlunsplit(url._replace(query=query))
+
+# registers for stream notifications for one streamer with twitch webhook
+# these ones do not expire (check every day just in case?)
+# returns True if twitch accepted the registration
+async def registerSub(streamer):
+    if (eventsubTransport == "websocket"):
+        return await registerSocketSub(streamer)
+    subSecret = secrets.token_urlsafe(32)
+    payload = {
+        "type": "stream.online",
+        "version": "1",
+        "condition": {
+            "broadcaster_user_id": str(streamer)
+        },
+        "transport": {
+            "method": "webhook",
+            # the streamer id lets the listener find the secret before decoding the body
+            "callback": callbackUrl(streamer),
+            "secret": subSecret,
+        }
+    }
+
+    # send notification registration request
+    req = await twitchApi.post("/eventsub/subscriptions", json=payload, retries=3)
+
+    # save request pending confirmation from Twitch
+    if(req.ok):
+        pendingSubs.add(req.data['data'][0], subSecret)
+        return True
+    # subscription already exists for this streamer
+    if (req.status == 409):
+        logging.info("sub for streamer %s already exists" % streamer)
+        return True
+    logging.error("ERROR REGISTERING SUB: %s (%i)" % (streamer, req.status))
+    return False
+
+# registers a streamer on the current eventsub websocket session
+# these are enabled straight away (no verification) and end with the session
+async def registerSocketSub(streamer):
+    sessionId = eventsub.sessionId
+    if (not sessionId):
+        logging.info("no eventsub session, streamer %s is registered once connected" % streamer)
+        return False
+    payload = {
+        "type": "stream.online",
+        "version": "1",
+        "condition": {
+            "broadcaster_user_id": str(streamer)
+        },
+        "transport": {
+            "method": "websocket",
+            "session_id": sessionId,
+        }
+    }
+    req = await twitchApi.post("/eventsub/subscriptions", json=payload, retries=3, tokens=userTokens)
+    if (req.ok):
+        # a subscription for a session that has since ended is gone already
+        if (eventsub.sessionId == sessionId):
+            eventsub.subs[int(streamer)] = req.data['data'][0]['id']
+        return True
+    if (req.status == 409):
+        logging.info("sub for streamer %s already exists" % streamer)
+        return True
+    logging.error("ERROR REGISTERING SUB: %s (%i)" % (streamer, req.status))
+    return False
+
 # registers for notifications for each streamer in streamers
-def registerSubs(streamers):
+# runs registerConcurrency registrations at a time, the twitch client slows down
+# when the helix rate limit bucket runs low
+async def registerSubs(streamers):
     # exit if list empty
     if(len(streamers) == 0):
         return
+    # other workers leave registration to the ingress worker, which
+    # registers new streamers when it receives the index sync
+    if (not workerCluster.isIngress):
+        return
 
-    for streamer in streamers:
-        # register for stream notifications with twitch webhook
-        # these ones do not expire (check every day just in case?)
-        letters = string.ascii_lowercase + string.ascii_uppercase + string.digits
-        subSecret = ''
-        for i in range(20):
-            subSecret += random.choice(letters)
-
-        webhookurl = "https://api.twitch.tv/helix/eventsub/subscriptions"
-        payload = {
-            "type": "stream.online",
-            "version": "1",
-            "condition": {
-                "broadcaster_user_id": streamer
-            },
-            "transport": {
-                "method": "webhook",
-                "callback": os.getenv("CALLBACK_URL"),
-                "secret": subSecret,
-            }
-        }
-
-        header = {"Content-Type":"application/json", "Client-ID": twitchId, 'Authorization' : 'Bearer ' + twitchToken}
-
-        # send notification registration request
-        req = requests.post(webhookurl, headers=header, json = payload)
-
-
-        # save request pending confirmation from Twitch
-        if(req.ok):
-            pendingSubs.append((req.json()['data'][0], subSecret))
+    streamers = list(streamers)
+    registered = 0
+    for start in range(0, len(streamers), registerConcurrency):
+        batch = streamers[start:start + registerConcurrency]
+        results = await asyncio.gather(*[registerSub(streamer) for streamer in batch])
+        registered += sum(results)
+        logging.info("registered %i/%i subs (%i failed)" % (registered, len(streamers), start + len(batch) - registered))
 
 # returns privilege level of user
 def getPrivilege(user, channel):
-    if str(user.id) in globalMods:
+    if index.isGlobalMod(user.id):
         return 9
     if channel.permissions_for(user).manage_guild:
         return 8
     return 0
 
-# gets full list of subs from twitch
-def getTwitchSubs():
-    url = "https://api.twitch.tv/helix/eventsub/subscriptions"
-    header = {"Client-ID": twitchId, 'Authorization' : 'Bearer ' + twitchToken}
-    subs = requests.get(url, headers=header).json()['data']
-    logging.info(subs)
-    return subs
     
 
 # called once discord client is connected
@@ -195,333 +510,434 @@ async def on_ready():
     global app
     logging.info("Discord client connected")
     # set discord bot status
-    game = discord.Game("!pingme {streamername} \n !pingmenot {streamername}")
-    registerDaily.start()
+    prefix = "/" if commandMode == "slash" else "!"
+    game = discord.Game("%spingme {streamername} \n %spingmenot {streamername}" % (prefix, prefix))
+    # websocket subscriptions are recreated with each session instead
+    if (workerCluster.isIngress and eventsubTransport == "webhook" and not reconcileSubs.is_running()):
+        reconcileSubs.start()
+    # pings left from before a restart can be sent once channels resolve
+    outbox.start()
     await client.change_presence(activity=game, status=discord.Status.online)
 
 # called when bot is removed from guild
 @client.event
 async def on_guild_remove(guild):
     # remove subscriptions for that guild from the database
-    # no need to manually remove twitch subscriptions - will be removed as a daily task
-    db.delAllSubscriptions(guild.id)
+    # no need to manually remove twitch subscriptions - will be removed by the next reconcile
+    streamers = index.getGuildStreamers(guild.id)
+    await index.delAllSubscriptions(guild.id)
+    await syncIndex(streamers)
+
+# tells the other workers to re-read streamers (and global moderators) changed by this one
+async def syncIndex(streamers, mods=False):
+    await workerCluster.broadcast("/sync", {"streamers": [int(streamer) for streamer in streamers], "mods": mods})
+
+# chat commands, looked up by their first word
+commands = commandRouter.CommandRouter(getPrivilege)
 
 # called every message - only reacts to the commands
 @client.event
 async def on_message(message):
-    # show streamers available on the server
-    if message.content.startswith("!streamers"):
-        streamers = db.getAllSubscriptions(message.guild.id)
-        logging.info(streamers)
-        if len(streamers) == 0:
-            await message.channel.send("No stream notifications found on this server")
-            return
-        toSend = "This server has notifications available for %i streamer%s: ```\n" % (len(streamers), '' if len(streamers) == 1 else 's')
-        users = helix_api.users([int(streamer[0]) for streamer in streamers])
-        userNames = [user.display_name for user in users]
-        userNames.sort(key=str.casefold)
-        for user in userNames:
-            toSend += "\t - %s\n" % user
-        toSend += "```"
-        await message.channel.send(toSend)
-    # add/remove role from user for a streamer's pings
-    if message.content.startswith('!pingme'):
-        fields = message.content.split()
-        if (fields[0] != '!pingme' and fields[0] != '!pingmenot'):
-            return
-        if (len(fields) == 1):
-            await message.channel.send("Command `%s` requires a streamer as an argument" % fields[0])
-            return
-        user = helix_api.user(fields[1])
-        # no user found matching id/name
-        if (not user):
-            await message.channel.send("Twitch streamer `%s` not found" % fields[1])
-            return
-        currentSub = db.findSubscription(user.id, message.guild.id)
-        if (not currentSub):
-            await message.channel.send("Twitch streamer `%s` notifications not added to this server" % user.display_name)
-            return
-        roleId = int(currentSub[1])
-        role = discord.utils.get(message.guild.roles, id=roleId)
-        if message.content.startswith('!pingmenot'):
-            logging.info("Removing role %s from user %s" %(role.name, message.author.name))
-            await message.author.remove_roles(role)
-        else:
-            logging.info("Adding role %s to user %s" %(role.name, message.author.name))
-            await message.author.add_roles(role)
-        await message.add_reaction("👍")
-        
-    # ---------
-    # ---------
+    await commands.dispatch(message)
+
+# application commands run the same handlers, synced with discord on startup
+if (commandMode != "message"):
+    tree = discord.app_commands.CommandTree(client)
+    slashCommands.addSlashCommands(tree, commands)
+
+    # one worker is enough to sync the commands
+    async def syncCommands():
+        if (workerCluster.isIngress):
+            await tree.sync()
+    client.setup_hook = syncCommands
+
+# show streamers available on the server
+@commands.command("!streamers")
+async def listStreamers(message, args):
+    streamers = index.getGuildStreamers(message.guild.id)
+    if len(streamers) == 0:
+        await message.channel.send("No stream notifications found on this server")
+        return
+    toSend = "This server has notifications available for %i streamer%s: ```\n" % (len(streamers), '' if len(streamers) == 1 else 's')
+    userNames = [user.display_name for user in await users.getUsersById(streamers)]
+    userNames.sort(key=str.casefold)
+    for user in userNames:
+        toSend += "\t - %s\n" % user
+    toSend += "```"
+    await message.channel.send(toSend)
+
+# add/remove role from user for a streamer's pings
+async def setPingRole(message, args, command, add):
+    if (len(args) == 0):
+        await message.channel.send("Command `%s` requires a streamer as an argument" % command)
+        return
+    user = await users.get(args[0])
+    # no user found matching id/name
+    if (not user):
+        await message.channel.send("Twitch streamer `%s` not found" % args[0])
+        return
+    currentSub = index.findSubscription(user.id, message.guild.id)
+    if (not currentSub):
+        await message.channel.send("Twitch streamer `%s` notifications not added to this server" % user.display_name)
+        return
+    roleId = currentSub.roleId
+    role = discord.utils.get(message.guild.roles, id=roleId)
+    if add:
+        logging.info("Adding role %s to user %s" %(role.name, message.author.name))
+        await message.author.add_roles(role)
+    else:
+        logging.info("Removing role %s from user %s" %(role.name, message.author.name))
+        await message.author.remove_roles(role)
+    await message.add_reaction("👍")
 
-    # commands below require privileges
+@commands.command("!pingme")
+async def pingMe(message, args):
+    await setPingRole(message, args, "!pingme", True)
 
-    # ---------
-    # ---------
-    
-    # add streamer notifications to the current channel+guild
-    elif message.content.startswith("!addnotifs"):
-        if(getPrivilege(message.author, message.channel) < 5):
-            return
-        fields = message.content.split()
-        user = helix_api.user(fields[1])
-        if (len(fields) == 1):
-            await message.channel.send("Command !addnotifs requires a streamer as an argument")
-            return
-        # no user found matching id/name
-        if (not user):
-            await message.channel.send("Twitch streamer `%s` not found" % fields[1])
-            return
-
-        # check to see if subscription to this streamer already exists in this guild
-        # if so, don't create a new one
-        currentSub = db.findSubscription(user.id, message.guild.id)
-        if (currentSub):
-            channel = client.get_channel(int(currentSub[0]))
-            await message.channel.send("Notifications for streamer `%s` already exist in channel %s" % (user.display_name, channel.mention))
-            return
-        # 3rd argument is role name/id
-        if len(fields) >= 3:
-            newRole = None
-            if (fields[2].lower() != 'none'):  
-                # find role by id
-                if (fields[2].isdigit()):
-                    newRole = discord.utils.get(message.guild.roles, id=int(fields[2]))
-                # not valid id - find by name
-                if not newRole:
-                    name = ""
-                    for x in range(2, len(fields)):
-                        name += fields[x]
-                        name += " "
-                    newRole = discord.utils.get(message.guild.roles, name=name)
-                # not valid name - make new role with matching name
-                if not newRole:
-                    newRole = await message.guild.create_role(name=name, mentionable=True)
-        # no role passed - create new role with default name
-        else:   
-            newRole = await message.guild.create_role(name=user.display_name+" pings", mentionable=True)
-
-        # check to see if this is a subscription to a new streamer
-        if (not db.streamerExists(user.id)):
-            # register for notifications for this streamer
-            registerSubs([user.id])
-        # add subscription to database
-        db.addStreamerSub(models.discordTwitchSubscription.DiscordTwitchSubscription(user.id, message.guild.id, message.channel.id, newRole.id, defaultMessage))
-        if newRole:
-            await message.channel.send("Notifications for streamer `%s` added in channel %s for role `%s`" % (user.display_name, message.channel.mention, newRole.name))
-        else:
-            await message.channel.send("Notifications for streamer `%s` added in channel %s" % (user.display_name, message.channel.mention, newRole.name))
+@commands.command("!pingmenot")
+async def pingMeNot(message, args):
+    await setPingRole(message, args, "!pingmenot", False)
 
-    # update going live message
-    elif message.content.startswith("!changemessage"):
-        if(getPrivilege(message.author, message.channel) < 5):
-            return
-        fields = message.content.split()
-        if (len(fields) < 2):
-            await message.channel.send("Command !changemessage requires a streamer and a message as arguments")
-            return
+# ---------
+# ---------
 
-    # remove streamer notifications from the guild
-    elif message.content.startswith("!removenotifs"):
-        if(getPrivilege(message.author, message.channel) < 5):
-            return
-        fields = message.content.split()
-        if (len(fields) == 1):
-            await message.channel.send("Command !removenotifs requires a streamer as an argument")
-            return
-        user = helix_api.user(fields[1])
-        # no user found matching id/name
-        if (not user):
-            await message.channel.send("Twitch streamer `%s` not found" % fields[1])
-            return
-        # fetch subscription
-        currentSub = db.findSubscription(user.id, message.guild.id)
-        if (not currentSub):
-            await message.channel.send("No notifications for streamer `%s` found" % user.display_name)
-            return
-        # delete role?
-        toDelete = False
-        if len(fields) > 2:
-            toDelete = fields[2].lower() == "-d"
-        if (toDelete):
-            role = discord.utils.get(message.guild.roles, id=int(currentSub[1]))
-            await role.delete()
-        db.delSubscription(user.id, message.guild.id)
-        await message.add_reaction("👍")
-
-    # get ALL twitch streamers for which this instance of the bot gets notifications
-    elif message.content.startswith("!subs"):
-        if(getPrivilege(message.author, message.channel) < 9):
-            return
-        url = "https://api.twitch.tv/helix/eventsub/subscriptions"
-        header = {"Client-ID": twitchId, 'Authorization' : 'Bearer ' + twitchToken}
-        subs = requests.get(url, headers=header).json()['data']
-        userIds = []
-        # parse each subscription and add twitch user ID to the list
-        logging.info("ACTIVE TWITCH SUBS:")
-        for sub in subs:
-            logging.info(sub)
-            # check that this is a streamer subscription
-            if (sub['type'] == 'stream.online'):
-                # parse topic for the user ID
-                uid = sub['condition']['broadcaster_user_id']
-                if (sub['status'] == "enabled"):
-                    userIds.append(int(uid))
-        # get user objects from IDs
-        users = helix_api.users(userIds)
-        userNames = [user.display_name for user in users]
-        userNames.sort(key=str.casefold)
-        # build message including names of all streamers
-        toSend = "Bot currently gets notifications for %i streamer%s: ```\n" % (len(userNames), '' if len(userNames) == 1 else 's')
-        for name in userNames:
-            toSend += "\t - %s\n" % name
-        toSend += "```"
-        await message.channel.send(toSend)
-
-
-    elif message.content.startswith("!clearsubs"):
-        if(getPrivilege(message.author, message.channel) < 9):
-            return
-        subs = getTwitchSubs()
-        await clearSubs(subs)
-        db.clearActiveSubscriptions()
+# commands below require privileges
 
-    # add global moderator
-    elif message.content.startswith("!addmod"):
-        if(getPrivilege(message.author, message.channel) < 9):
-            return
-        fields = message.content.split()
-        user = client.get_user(int(fields[1]))
-        if (not user):
-            await message.channel.send("User not found")
-            return
-        if (fields[1] in globalMods):
-            await message.channel.send("%s is already a global moderator" % user.name)
-            return
-        globalMods.append(fields[1])
-        db.addGlobalMod(fields[1])
-        await message.add_reaction("👍")
-        
+# ---------
+# ---------
 
-# removes all subscriptions in subs list
-async def clearSubs(subs):
-    webhookurl = "https://api.twitch.tv/helix/eventsub/subscriptions"
-    for sub in subs:
-        logging.info(sub)
-        finalUrl = webhookurl + "?id=" + sub['id']
-        # build headers and send request
-        header = {"Client-ID": twitchId, 'Authorization' : 'Bearer ' + twitchToken}
-        temp = requests.delete(finalUrl, headers=header)
-        if (not temp.ok):
-            logging.error("ERROR DELETING SUB: " + sub['id'])
-            logging.error(temp.json())
-        
+# add streamer notifications to the current channel+guild
+@commands.command("!addnotifs", privilege=5)
+async def addNotifs(message, args):
+    if (len(args) == 0):
+        await message.channel.send("Command !addnotifs requires a streamer as an argument")
+        return
+    user = await users.get(args[0])
+    # no user found matching id/name
+    if (not user):
+        await message.channel.send("Twitch streamer `%s` not found" % args[0])
+        return
 
+    # check to see if subscription to this streamer already exists in this guild
+    # if so, don't create a new one
+    currentSub = index.findSubscription(user.id, message.guild.id)
+    if (currentSub):
+        channel = client.get_channel(currentSub.channelId)
+        await message.channel.send("Notifications for streamer `%s` already exist in channel %s" % (user.display_name, channel.mention))
+        return
+    # 2nd argument is role name/id
+    if len(args) >= 2:
+        newRole = None
+        if (args[1].lower() != 'none'):
+            # find role by id
+            if (args[1].isdigit()):
+                newRole = discord.utils.get(message.guild.roles, id=int(args[1]))
+            # not valid id - find by name
+            if not newRole:
+                name = " ".join(args[1:])
+                newRole = discord.utils.get(message.guild.roles, name=name)
+            # not valid name - make new role with matching name
+            if not newRole:
+                newRole = await message.guild.create_role(name=name, mentionable=True)
+    # no role passed - create new role with default name
+    else:
+        newRole = await message.guild.create_role(name=user.display_name+" pings", mentionable=True)
+
+    # check to see if this is a subscription to a new streamer
+    if (not index.streamerExists(user.id)):
+        # register for notifications for this streamer
+        await registerSubs([user.id])
+    # add subscription to database
+    await index.addStreamerSub(models.discordTwitchSubscription.DiscordTwitchSubscription(user.id, message.guild.id, message.channel.id, newRole.id, defaultMessage))
+    await syncIndex([user.id])
+    if newRole:
+        await message.channel.send("Notifications for streamer `%s` added in channel %s for role `%s`" % (user.display_name, message.channel.mention, newRole.name))
+    else:
+        await message.channel.send("Notifications for streamer `%s` added in channel %s" % (user.display_name, message.channel.mention, newRole.name))
 
+# update going live message
+@commands.command("!changemessage", privilege=5)
+async def changeMessage(message, args):
+    if (len(args) < 1):
+        await message.channel.send("Command !changemessage requires a streamer and a message as arguments")
+        return
 
-# sends ping message to each sub group
-async def sendPings(subs: list):
+# remove streamer notifications from the guild
+@commands.command("!removenotifs", privilege=5)
+async def removeNotifs(message, args):
+    if (len(args) == 0):
+        await message.channel.send("Command !removenotifs requires a streamer as an argument")
+        return
+    user = await users.get(args[0])
+    # no user found matching id/name
+    if (not user):
+        await message.channel.send("Twitch streamer `%s` not found" % args[0])
+        return
+    # fetch subscription
+    currentSub = index.findSubscription(user.id, message.guild.id)
+    if (not currentSub):
+        await message.channel.send("No notifications for streamer `%s` found" % user.display_name)
+        return
+    # delete role?
+    toDelete = False
+    if len(args) > 1:
+        toDelete = args[1].lower() == "-d"
+    if (toDelete):
+        role = discord.utils.get(message.guild.roles, id=currentSub.roleId)
+        await role.delete()
+    await index.delSubscription(user.id, message.guild.id)
+    await syncIndex([user.id])
+    await message.add_reaction("👍")
+
+# get ALL twitch streamers for which this instance of the bot gets notifications
+@commands.command("!subs", privilege=9)
+async def listSubs(message, args):
+    userIds = []
+    # parse each live streamer subscription and add twitch user ID to the list
+    try:
+        async for sub in twitchApi.iterSubscriptions(status="enabled", type="stream.online"):
+            userIds.append(int(sub['condition']['broadcaster_user_id']))
+    except twitchClient.TwitchError as e:
+        await message.channel.send("Could not fetch subscriptions from Twitch: %s" % e)
+        return
+    logging.info("%i ACTIVE TWITCH SUBS" % len(userIds))
+    # get user objects from IDs
+    userNames = [user.display_name for user in await users.getUsersById(userIds)]
+    userNames.sort(key=str.casefold)
+    # build message including names of all streamers
+    toSend = "Bot currently gets notifications for %i streamer%s: ```\n" % (len(userNames), '' if len(userNames) == 1 else 's')
+    for name in userNames:
+        toSend += "\t - %s\n" % name
+    toSend += "```"
+    await message.channel.send(toSend)
+
+@commands.command("!clearsubs", privilege=9)
+async def clearAllSubs(message, args):
+    try:
+        subs = [sub async for sub in twitchApi.iterSubscriptions()]
+    except twitchClient.TwitchError as e:
+        await message.channel.send("Could not fetch subscriptions from Twitch: %s" % e)
+        return
+    result = await clearSubs(subs)
+    await message.channel.send("Deleted %i subs, %i already gone, %i failed" % (len(result.deleted), len(result.alreadyGone), len(result.failed)))
+
+# fix twitch subscriptions now instead of waiting for the next scheduled run
+# only the ingress worker knows the registered subscriptions, other workers forward the command
+@commands.command("!reconcile", privilege=9)
+async def reconcileNow(message, args):
+    if (workerCluster.isIngress):
+        await message.channel.send(await reconcile())
+        return
+    body = await workerCluster.call(0, "/reconcile", {}, timeout=600)
+    await message.channel.send(body['report'] if body else "Could not reach the ingress worker")
+
+# returns a report for !reconcile
+async def reconcile():
+    if (eventsubTransport == "websocket"):
+        missing = [streamer for streamer in index.getAllStreamers() if not hasSubscription(streamer)]
+        await registerSubs(missing)
+        return "Registered %i streamers missing from the eventsub session" % len(missing)
+    result = await subReconciler.run()
+    if (result is None):
+        return "Reconcile already running or Twitch unavailable"
+    return "Reconciled: %i subs deleted, %i streamers registered" % result
+
+# show webhook work queue stats
+@commands.command("!queue", privilege=9)
+async def queueStats(message, args):
+    stats = webhookQueue.stats()
+    toSend = "Webhook queue: %i queued, %i processed, %i rejected, %i failed. Wait last %.2fs, avg %.2fs, max %.2fs" % (stats['depth'], stats['processed'], stats['rejected'], stats['failed'], stats['lastWait'], stats['avgWait'], stats['maxWait'])
+    if (metrics.revocations.values):
+        toSend += "\nRevocations: " + ", ".join("%s %i" % (reason, count) for (reason,), count in sorted(metrics.revocations.values.items(), key=lambda item: -item[1]))
+    await message.channel.send(toSend)
+
+# show how often each command was used and how long it took
+@commands.command("!cmdstats", privilege=9)
+async def commandStats(message, args):
+    toSend = "```\n"
+    for name, calls, average, longest in commands.stats():
+        toSend += "%-16s %6i calls, avg %.3fs, max %.3fs\n" % (name, calls, average, longest)
+    toSend += "```"
+    await message.channel.send(toSend)
+
+# add global moderator
+@commands.command("!addmod", privilege=9)
+async def addMod(message, args):
+    if (len(args) == 0 or not args[0].isdigit()):
+        await message.channel.send("Command !addmod requires a user id as an argument")
+        return
+    user = client.get_user(int(args[0]))
+    if (not user):
+        await message.channel.send("User not found")
+        return
+    if (index.isGlobalMod(user.id)):
+        await message.channel.send("%s is already a global moderator" % user.name)
+        return
+    await index.addGlobalMod(user.id)
+    await syncIndex([], mods=True)
+    await message.add_reaction("👍")
+
+# deletes one subscription with twitch, returns the response status
+async def deleteSub(sub):
+    req = await twitchApi.delete("/eventsub/subscriptions", params={"id": sub['id']}, retries=3)
+    if (not req.ok and req.status != 404):
+        logging.error("ERROR DELETING SUB: %s (%i)" % (sub['id'], req.status))
+    return req.status
+
+# removes all subscriptions in subs list, clearConcurrency at a time
+# returns a ClearResult, subscriptions that no longer exist are also removed from the active sub table
+async def clearSubs(subs):
+    result = models.clearResult.ClearResult()
+    for start in range(0, len(subs), clearConcurrency):
+        batch = subs[start:start + clearConcurrency]
+        statuses = await asyncio.gather(*[deleteSub(sub) for sub in batch])
+        for sub, status in zip(batch, statuses):
+            if (200 <= status < 300):
+                result.deleted.append(sub)
+            elif (status == 404):
+                result.alreadyGone.append(sub)
+            else:
+                result.failed.append(sub)
+        logging.info("cleared %i/%i subs" % (start + len(batch), len(subs)))
+    await index.delActiveSubscriptions([(sub['id'], sub['condition']['broadcaster_user_id']) for sub in result.deleted + result.alreadyGone])
+    return result
+
+# queued by streamOnline when a streamer goes live
+# twitch already got its answer and won't resend, the go-live saved by streamOnline is
+# what survives a crash until the pings are stored (and is deleted once they are)
+# pings that could not be stored are retried here with backoff. if they still can't be,
+# the stream is no longer marked live so a later notification of it goes through, and
+# the saved go-live is tried again at the next start
+async def goLive(streamerId, streamId, startedAt, previousStreamId=None):
+    subs = index.getStreamerSubs(streamerId)
+    for attempt in range(goLiveRetries + 1):
+        if (attempt):
+            await asyncio.sleep(2 ** (attempt - 1))
+        try:
+            subs = await routePings(subs, streamId, startedAt)
+        except Exception:
+            logging.exception("storing pings for streamer %i failed" % streamerId)
+        if (not subs):
+            index.setLastStreamId(streamerId, streamId)
+            await db.delGoLive(streamerId, streamId)
+            return
+    logging.error("gave up storing %i pings for streamer %i" % (len(subs), streamerId))
+    index.unmarkLive(streamerId, streamId, previousStreamId)
+
+# queues the go-lives saved by streamOnline whose pings were never stored
+# pings already stored before a crash are not stored twice (see addOutboxPings), but
+# ones already sent may be sent again
+async def replayGoLives():
+    for streamerId, streamId, startedAt in await db.loadGoLives():
+        previousStreamId = index.getLastStreamId(streamerId)
+        # finished, but the crash came before the go-live was deleted
+        # too old ones would be dropped by the outbox anyway
+        if (previousStreamId == str(streamId) or time.time() - startedAt > outbox.maxAge):
+            await db.delGoLive(streamerId, streamId)
+            continue
+        logging.info("replaying go-live of streamer %i" % streamerId)
+        if (webhookQueue.submit(goLive, streamerId, streamId, startedAt, previousStreamId)):
+            index.markLive(streamerId, streamId)
+
+# mention of a role without looking it up, the @everyone role has the guild's id
+def roleMention(guildId, roleId):
+    if (not roleId):
+        return ''
+    if (roleId == guildId):
+        return "@everyone"
+    return "<@&%i>" % roleId
+
+# stores the ping message of each sub in the outbox, the outbox sends them
+# startedAt is the epoch time the stream went live, used to report ping latency
+# returns False if the pings could not be stored
+async def sendPings(subs: list, streamId, startedAt=None):
     # exit if list empty
     if(len(subs) == 0):
-        return
+        return True
     # all will be about the same streamer
-    streamer = helix_api.user(subs[0].streamerId)
+    streamer = await users.getById(subs[0].streamerId)
+    if (not streamer):
+        logging.error("could not look up streamer %i, no pings sent" % subs[0].streamerId)
+        return False
     logging.info(streamer.display_name + " has gone live, sending notifs")
+    if (startedAt is None):
+        startedAt = time.time()
+    link = "https://twitch.tv/" + streamer.display_name
+    pings = []
     for sub in subs:
         # extract subscription information
+        # pings are stored even if discord hasn't loaded the guild yet (e.g. right after a
+        # start), the outbox drops the ones whose channel is still missing when it sends them
         guild = client.get_guild(sub.guildId)
-        role = guild.get_role(sub.roleId)
-        channel = client.get_channel(sub.channelId)
-        # build message text from possible placeholders
-        message = sub.message.replace("$link", "https://twitch.tv/" + streamer.display_name)
-        mention = ''
-        if (role):
-            mention = role.mention
-        message = message.replace("$role", mention)
-        await channel.send(message)
-
-# check Twitch token, renew if needed
-async def twitchAuth():
-    global twitchToken
-    # URL to check token
-    if (twitchToken != None):
-        valurl = "https://id.twitch.tv/oauth2/validate"
-        header = {"Client-ID": twitchId, 'Authorization' : 'Bearer ' + twitchToken}
-        req = requests.get(valurl, headers=header).json()
-        expiry = 0
-        if ('expires_in' in req):
-            expiry = req['expires_in']
-        # mark for renewal if expires today
-        if (expiry < 90000):
-            twitchToken = None
-    # renew token
-    if (twitchToken == None):
-        # build URL to receive token
-        authurl = "https://id.twitch.tv/oauth2/token?client_id=" + twitchId + "&client_secret=" + twitchSecret + "&grant_type=client_credentials"
-        
-        # extract response
-        req = requests.post(authurl)
-        twitchToken = req.json()['access_token']
-
-# clear subscriptions that aren't live (registered with Twitch but non-functional)
-async def clearInvalidSubs(subs):
-    invalidSubs = list(filter(lambda sub: sub['status'] != "enabled", subs))
-    logging.info("%i INVALID SUBS" % (len(invalidSubs)))
-    await clearSubs(invalidSubs)
-
-# clear subscriptions that aren't being used (registered with Twitch but no Discord channels want notifs)
-async def clearUnwantedSubs(subs):
-    # all streamers for which we need notifications
-    neededSubs = db.getAllStreamers()
-
-    toRemove = []
-    # find obsolete subs
+        if (guild):
+            role = guild.get_role(sub.roleId)
+            mention = role.mention if role else ''
+        else:
+            mention = roleMention(sub.guildId, sub.roleId)
+        # placeholders are filled in when the message is planned (see pingPlanner.py)
+        pings.append(models.outboxPing.OutboxPing(streamId, sub.guildId, sub.channelId, sub.message, link, mention, startedAt))
+    try:
+        await outbox.add(pings)
+    except Exception:
+        logging.exception("could not store %i pings for streamer %i" % (len(pings), subs[0].streamerId))
+        return False
+    return True
+
+# stores pings, handing the ones for guilds owned by other workers to them
+# returns the subs whose pings could not be stored
+async def routePings(subs: list, streamId, startedAt=None):
+    if (not workerCluster.enabled):
+        return [] if await sendPings(subs, streamId, startedAt) else subs
+    byWorker = {}
     for sub in subs:
-        if sub['condition']['broadcaster_user_id'] not in neededSubs:
-            toRemove.append(sub)
-    logging.info("OBSOLETE SUBS:::::")
-    logging.info(toRemove)
-    # de-register obsolete subs with twitch
-    await clearSubs(toRemove)
-
-# get known subscriptions that need to be re-registered with Twitch
-def getInactiveSubs(subs):
-    # all streamers for which we need notifications
-    neededSubs = db.getAllStreamers()
-
-    # live subscriptions on twitch
-    activeSubs = filter(lambda sub: sub['status'] == "enabled", subs)
-    activeSubs = list(map(lambda sub: sub['condition']['broadcaster_user_id'], activeSubs))
-
-    logging.info("%i ACTIVE SUBS: %s" % (len(activeSubs), activeSubs))
-    toRenew = []
-    # find lapsed subs
-    for sub in neededSubs:
-        if sub not in activeSubs:
-            logging.info(sub)
-            toRenew.append(sub)
-    return toRenew
+        byWorker.setdefault(workerCluster.workerForGuild(sub.guildId), []).append(sub)
+    sends = []
+    for worker, workerSubs in byWorker.items():
+        if (worker == workerCluster.workerIndex):
+            sends.append(sendPings(workerSubs, streamId, startedAt))
+        else:
+            payload = {"streamerId": workerSubs[0].streamerId, "streamId": streamId, "startedAt": startedAt, "subs": [[sub.guildId, sub.channelId, sub.roleId, sub.message] for sub in workerSubs]}
+            sends.append(workerCluster.post(worker, "/deliver", payload))
+    stored = await asyncio.gather(*sends)
+    return [sub for workerSubs, ok in zip(byWorker.values(), stored) if not ok for sub in workerSubs]
+
+# compares twitch subscriptions against the index and fixes the difference
+subReconciler = reconciler.Reconciler(twitchApi, index, pendingSubs, clearSubs, registerSubs)
 
 # job added to the discord client's event loop
-# cleans up twitch api registrations every 24 hours
-@tasks.loop(hours=24)
-async def registerDaily():
-    logging.info("Registering...")
-    await twitchAuth()
-    # get all twitch subscriptions
-    subs = getTwitchSubs()
-    # unsubscribe from obsolete subscriptions (no longer being pushed to any discords)
-    await clearUnwantedSubs(subs)
-    # clear non-live twitch subscriptions (invalid for some reason - expired or revoked etc)
-    await clearInvalidSubs(subs)
-    # renew non-live but needed subs
-    registerSubs(getInactiveSubs(subs))
-
-# start listening to twitch API
-app.listen(int(port), xheaders=True)
-
-loop = asyncio.get_event_loop()
-asyncio.ensure_future(client.start(os.getenv("DISCORD_TOKEN")), loop=loop)
-# hand control over to the client
-loop.run_forever()
+# cleans up twitch api registrations every few minutes
+@tasks.loop(minutes=int(os.getenv("RECONCILE_MINUTES", 15)))
+async def reconcileSubs():
+    logging.info("Reconciling...")
+    await subReconciler.run()
+
+def main():
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(index.load())
+    loop.run_until_complete(outbox.load())
+    # only the ingress worker receives go-lives
+    if (workerCluster.isIngress):
+        loop.run_until_complete(replayGoLives())
+    # start listening to twitch API
+    # with several workers only the ingress worker does, the others get pings forwarded
+    # with the websocket transport the port only serves /metrics and is optional
+    if (workerCluster.isIngress and (eventsubTransport == "webhook" or port)):
+        app.listen(int(port), xheaders=True, max_body_size=webhookMaxBody)
+    if (workerCluster.enabled):
+        clusterApp.listen(workerCluster.internalPort + workerCluster.workerIndex, address="127.0.0.1")
+    webhookQueue.start()
+    twitchApi.tokens.start()
+    if (workerCluster.isIngress and eventsubTransport == "websocket"):
+        if (not userTokens.token):
+            logging.error("EVENTSUB_TRANSPORT=websocket needs TWITCH_USER_TOKEN")
+        userTokens.start()
+        eventsub.start()
+
+    asyncio.ensure_future(client.start(os.getenv("DISCORD_TOKEN")), loop=loop)
+    # hand control over to the client
+    loop.run_forever()
+
+# importing the module (benchmarks/loadTest.py) sets everything up without connecting anywhere
+if __name__ == "__main__":
+    main()
 
@@ -0,0 +1,57 @@
+import collections
+import logging
+import time
+
+# twitch subscriptions registered but not yet verified, keyed by subscription id
+# entries twitch never verifies expire after timeout seconds, and the registry
+# never holds more than maxSize entries (oldest dropped first)
+class PendingSubscriptions:
+
+    def __init__(self, maxSize=10000, timeout=600):
+        self.maxSize = maxSize
+        self.timeout = timeout
+        # subscription id -> (payload, secret, deadline), oldest first
+        self.pending = collections.OrderedDict()
+        # streamer id -> subscription ids
+        self.byStreamer = {}
+
+    def __len__(self):
+        self.expire()
+        return len(self.pending)
+
+    def expire(self):
+        now = time.monotonic()
+        while self.pending:
+            subId, (payload, secret, deadline) = next(iter(self.pending.items()))
+            if deadline > now and len(self.pending) <= self.maxSize:
+                return
+            self.remove(subId)
+            logging.info("pending sub %s for streamer %s expired unverified" % (subId, payload['condition']['broadcaster_user_id']))
+
+    def add(self, payload, secret):
+        self.pending[payload['id']] = (payload, secret, time.monotonic() + self.timeout)
+        self.byStreamer.setdefault(int(payload['condition']['broadcaster_user_id']), set()).add(payload['id'])
+        self.expire()
+
+    # returns (payload, secret) or None
+    def get(self, subId):
+        self.expire()
+        entry = self.pending.get(subId)
+        if entry is None:
+            return None
+        return entry[0], entry[1]
+
+    # returns [(subscription id, secret)] of the streamer's pending subscriptions
+    def forStreamer(self, streamerId):
+        self.expire()
+        return [(subId, self.pending[subId][1]) for subId in self.byStreamer.get(streamerId, ())]
+
+    def remove(self, subId):
+        entry = self.pending.pop(subId, None)
+        if entry is None:
+            return
+        streamerId = int(entry[0]['condition']['broadcaster_user_id'])
+        subIds = self.byStreamer[streamerId]
+        subIds.discard(subId)
+        if not subIds:
+            del self.byStreamer[streamerId]
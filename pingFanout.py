@@ -0,0 +1,89 @@
+import aiohttp
+import asyncio
+import discord
+import logging
+import metrics
+import time
+import weakref
+
+# delivers ping messages to many discord channels concurrently
+# the number of in-flight sends is bounded, sends to the same channel are serialized
+# (discord rate limits each channel separately) and a token bucket keeps the
+# overall request rate under discord's global limit
+class PingFanout:
+
+    def __init__(self, maxConcurrent=20, globalRate=45):
+        self.maxConcurrent = maxConcurrent
+        self.globalRate = globalRate
+        self.semaphore = None
+        self.bucketLock = None
+        self.tokens = globalRate
+        self.lastRefill = time.monotonic()
+        # locks are dropped once no send is using them
+        self.channelLocks = weakref.WeakValueDictionary()
+
+    # primitives are created lazily so they bind to the running event loop
+    def initLocks(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.maxConcurrent)
+            self.bucketLock = asyncio.Lock()
+
+    def channelLock(self, channelId):
+        lock = self.channelLocks.get(channelId)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.channelLocks[channelId] = lock
+        return lock
+
+    # wait for a slot in the global bucket
+    async def acquireGlobal(self):
+        async with self.bucketLock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.globalRate, self.tokens + (now - self.lastRefill) * self.globalRate)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.globalRate)
+
+    # sends one message, returns (http status, seconds from go-live until it was delivered)
+    # the status is 0 if discord couldn't be reached
+    # the latency is None if the send failed
+    async def deliverOne(self, channel, text, startedAt):
+        async with self.semaphore:
+            async with self.channelLock(channel.id):
+                await self.acquireGlobal()
+                start = time.perf_counter()
+                try:
+                    await channel.send(text)
+                except discord.HTTPException as e:
+                    logging.error("ping to channel %i failed: %s" % (channel.id, e))
+                    metrics.discordSends.inc(str(e.status))
+                    return e.status, None
+                # no response at all, reported as status 0
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.error("ping to channel %i failed: %s" % (channel.id, e))
+                    metrics.discordSends.inc("0")
+                    return 0, None
+                finally:
+                    metrics.discordSeconds.observe(time.perf_counter() - start)
+                metrics.discordSends.inc("200")
+        return 200, time.time() - startedAt
+
+    # deliveries is a list of (channel, text, startedAt) tuples
+    # startedAt is the epoch time the stream went live
+    # returns the http status of each send
+    async def deliver(self, deliveries):
+        if (len(deliveries) == 0):
+            return []
+        self.initLocks()
+        results = await asyncio.gather(*[self.deliverOne(channel, text, startedAt) for channel, text, startedAt in deliveries])
+        delivered = sorted(latency for status, latency in results if latency is not None)
+        if delivered:
+            metrics.goLiveFirstPing.observe(delivered[0])
+            metrics.goLiveLastPing.observe(delivered[-1])
+            logging.info("delivered %i/%i pings, go-live to first %.2fs, median %.2fs, last %.2fs" % (len(delivered), len(deliveries), delivered[0], delivered[len(delivered) // 2], delivered[-1]))
+        else:
+            logging.error("all %i pings failed" % len(deliveries))
+        return [status for status, latency in results]
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import metrics
+import pingPlanner
+import time
+
+# durable queue of pings (models.outboxPing) between a go-live and discord
+# pings are written to the pingOutbox table before anything is sent and deleted once
+# delivered, a copy is kept in memory so draining never reads the database
+# a single drainer sends everything that is ready in batches, pings for the same
+# channel coalesced into one message (pingPlanner.plan). a channel answering 429, 5xx
+# or not at all is retried with exponential backoff, other failures (missing permission,
+# deleted channel) are dropped, as are pings older than maxAge.
+# after a restart the table is loaded again so the pings left over are still sent
+# with several workers the table is shared, each worker only loads (and so only ever
+# sends or deletes) the pings of guilds it owns
+class PingOutbox:
+
+    def __init__(self, db, fanout, getChannel, ownsGuild=None, window=0.25, batchSize=500, maxAge=3600, maxBackoff=300):
+        self.db = db
+        self.fanout = fanout
+        # getChannel(channelId) returns the discord channel or None
+        self.getChannel = getChannel
+        # ownsGuild(guildId) is False for guilds another worker sends pings to
+        self.ownsGuild = ownsGuild or (lambda guildId: True)
+        # seconds to wait for more pings before draining
+        self.window = window
+        self.batchSize = batchSize
+        self.maxAge = maxAge
+        self.maxBackoff = maxBackoff
+        # (stream id, guild id) -> ping, oldest first
+        self.pings = {}
+        # channel id -> (monotonic time of the next attempt, current delay)
+        self.backoff = {}
+        self.wake = None
+        self.task = None
+
+    def __len__(self):
+        return len(self.pings)
+
+    async def load(self):
+        for ping in await self.db.loadOutbox():
+            if self.ownsGuild(ping.guildId):
+                self.pings[ping.key] = ping
+        if self.pings:
+            logging.info("%i undelivered pings in the outbox" % len(self.pings))
+
+    # starts the drainer, once the discord client can resolve channels
+    def start(self):
+        if self.task is None:
+            self.wake = asyncio.Event()
+            self.task = asyncio.get_event_loop().create_task(self.run())
+
+    # stores pings, they are sent by the drainer
+    async def add(self, pings):
+        await self.db.addOutboxPings(pings)
+        for ping in pings:
+            self.pings.setdefault(ping.key, ping)
+        if self.wake is not None:
+            self.wake.set()
+
+    def retryAt(self, channelId):
+        return self.backoff.get(channelId, (0, 0))[0]
+
+    # waits until there is a ping to send (or drop)
+    async def waitReady(self):
+        while True:
+            now = time.monotonic()
+            nextAttempt = min((self.retryAt(ping.channelId) for ping in self.pings.values()), default=None)
+            if nextAttempt is not None and nextAttempt <= now:
+                return
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), None if nextAttempt is None else nextAttempt - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        while True:
+            await self.waitReady()
+            # let the rest of a burst of go-lives arrive
+            await asyncio.sleep(self.window)
+            try:
+                await self.drain()
+            except Exception:
+                logging.exception("draining the ping outbox failed")
+                await asyncio.sleep(1)
+
+    # sends up to batchSize ready pings
+    async def drain(self):
+        now = time.time()
+        ready = time.monotonic()
+        done = []
+        byChannel = {}
+        count = 0
+        for ping in list(self.pings.values()):
+            if now - ping.startedAt > self.maxAge:
+                logging.error("dropping ping to channel %i, undelivered after %is" % (ping.channelId, self.maxAge))
+                done.append(ping)
+            elif self.retryAt(ping.channelId) <= ready and count < self.batchSize:
+                byChannel.setdefault(ping.channelId, []).append(ping)
+                count += 1
+        deliveries = []
+        members = []
+        for channelId, pings in byChannel.items():
+            channel = self.getChannel(channelId)
+            if channel is None:
+                logging.info("channel %i unavailable, dropping %i pings" % (channelId, len(pings)))
+                done.extend(pings)
+                continue
+            for text, startedAt, messagePings in pingPlanner.plan(pings):
+                deliveries.append((channel, text, startedAt))
+                members.append(messagePings)
+        if count > len(deliveries):
+            metrics.coalescedPings.inc(amount=count - len(deliveries))
+        statuses = await self.fanout.deliver(deliveries)
+        for (channel, text, startedAt), messagePings, status in zip(deliveries, members, statuses):
+            if status == 0 or status == 429 or status >= 500:
+                self.retryLater(channel.id)
+                continue
+            self.backoff.pop(channel.id, None)
+            if status != 200:
+                logging.error("dropping %i pings to channel %i (%i)" % (len(messagePings), channel.id, status))
+            done.extend(messagePings)
+        for ping in done:
+            self.pings.pop(ping.key, None)
+        # forget the backoff of channels nothing is waiting for anymore
+        for channelId in [channelId for channelId, (retryAt, delay) in self.backoff.items() if retryAt <= ready and channelId not in byChannel]:
+            del self.backoff[channelId]
+        # a crash before this delete means the pings are sent again (at least once)
+        if done:
+            await self.db.delOutboxPings([ping.key for ping in done])
+
+    def retryLater(self, channelId):
+        delay = min(self.backoff.get(channelId, (0, 0.5))[1] * 2, self.maxBackoff)
+        self.backoff[channelId] = (time.monotonic() + delay, delay)
+        logging.info("retrying pings to channel %i in %is" % (channelId, delay))
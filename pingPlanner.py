@@ -0,0 +1,53 @@
+# discord's message length limit
+MAX_LENGTH = 2000
+
+# fills in a ping template, mention is left out if None
+def render(template, link, mention):
+    text = template.replace("$link", link)
+    if mention is None:
+        return text.replace("$role", "").strip()
+    return text.replace("$role", mention)
+
+# a mention can be left out of a line when the template has it once, at the start or end
+def canMerge(template):
+    stripped = template.strip()
+    return stripped.count("$role") == 1 and (stripped.startswith("$role") or stripped.endswith("$role"))
+
+# plans the messages for the pings (OutboxPing) waiting for one channel
+# the pings are joined into one message (split at discord's length limit) and a role
+# already mentioned earlier in the message is not mentioned again where the template
+# allows it, so simultaneous go-lives cost one send per channel instead of one per
+# subscription
+# returns [(text, earliest startedAt, [pings in the message])]
+def plan(pings):
+    messages = []
+    text = None
+    startedAt = None
+    members = []
+    mentioned = set()
+    seen = set()
+    for ping in pings:
+        line = render(ping.message, ping.link, ping.mention)
+        # the same ping twice (e.g. a retried notification) is sent once
+        if line in seen and text is not None:
+            members.append(ping)
+            continue
+        seen.add(line)
+        if text is not None:
+            short = line
+            if ping.mention in mentioned and canMerge(ping.message):
+                short = render(ping.message, ping.link, None)
+            if len(text) + 1 + len(short) <= MAX_LENGTH:
+                text += "\n" + short
+                startedAt = min(startedAt, ping.startedAt)
+                members.append(ping)
+                mentioned.add(ping.mention)
+                continue
+            messages.append((text, startedAt, members))
+        text = line
+        startedAt = ping.startedAt
+        members = [ping]
+        mentioned = {ping.mention}
+    if text is not None:
+        messages.append((text, startedAt, members))
+    return messages
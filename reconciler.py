@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import twitchClient
+
+# brings twitch's eventsub subscriptions in line with the streamers discord guilds want
+# desired state comes from the in-memory index, actual state is streamed from twitch once,
+# both are compared as sets and only the difference is applied
+class Reconciler:
+
+    def __init__(self, api, index, pendingSubs, clearSubs, registerSubs):
+        self.api = api
+        self.index = index
+        self.pendingSubs = pendingSubs
+        self.clearSubs = clearSubs
+        self.registerSubs = registerSubs
+        self.lock = asyncio.Lock()
+
+    # a twitch subscription is only useful if we still hold its secret
+    def usable(self, sub, streamer):
+        if sub['status'] == "enabled":
+            active = self.index.findActiveSubscription(streamer)
+            return active is not None and active[0] == sub['id']
+        if sub['status'] == "webhook_callback_verification_pending":
+            return self.pendingSubs.get(sub['id']) is not None
+        # revoked, failed etc
+        return False
+
+    # returns (twitch subscriptions to delete, streamer ids to register)
+    async def diff(self):
+        desired = set(self.index.getAllStreamers())
+        # streamer id -> the one subscription kept for them
+        kept = {}
+        toDelete = []
+        async for sub in self.api.iterSubscriptions(type="stream.online"):
+            streamer = int(sub['condition']['broadcaster_user_id'])
+            if streamer not in desired or not self.usable(sub, streamer):
+                toDelete.append(sub)
+            elif streamer in kept:
+                # duplicate subscription for the same streamer
+                toDelete.append(sub)
+            else:
+                kept[streamer] = sub
+        return toDelete, desired - kept.keys()
+
+    # returns (number deleted, number registered) or None if nothing was done
+    async def run(self):
+        if self.lock.locked():
+            logging.info("reconcile already running")
+            return None
+        async with self.lock:
+            try:
+                toDelete, toRegister = await self.diff()
+            except twitchClient.TwitchError as e:
+                # give up on a partial listing rather than re-registering everything past it
+                logging.error("reconcile aborted: %s" % e)
+                return None
+            logging.info("reconcile: %i subs to delete, %i streamers to register" % (len(toDelete), len(toRegister)))
+            await self.clearSubs(toDelete)
+            await self.registerSubs(list(toRegister))
+            return len(toDelete), len(toRegister)
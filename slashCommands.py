@@ -0,0 +1,99 @@
+import discord
+from discord import app_commands
+
+# channel of an interaction, sends become replies to the interaction
+class InteractionChannel:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.replied = False
+
+    def __getattr__(self, name):
+        return getattr(self.interaction.channel, name)
+
+    async def send(self, text):
+        self.replied = True
+        await self.interaction.followup.send(text)
+
+# makes an application command interaction look like the message the chat command handlers expect
+class InteractionMessage:
+    def __init__(self, interaction):
+        self.author = interaction.user
+        self.guild = interaction.guild
+        self.channel = InteractionChannel(interaction)
+
+    async def add_reaction(self, emoji):
+        await self.channel.send(emoji)
+
+# runs a chat command handler for an interaction
+# the response is deferred first since handlers may take longer than discord's 3 seconds
+async def run(router, interaction, name, args):
+    await interaction.response.defer(thinking=True)
+    message = InteractionMessage(interaction)
+    if not await router.run(name, message, args):
+        await message.channel.send("You don't have permission to use this command")
+    elif not message.channel.replied:
+        await message.channel.send("Done")
+
+# registers an application command for each chat command in router
+def addSlashCommands(tree, router):
+
+    @tree.command(name="streamers", description="List streamers with notifications on this server")
+    @app_commands.guild_only()
+    async def streamers(interaction: discord.Interaction):
+        await run(router, interaction, "!streamers", [])
+
+    @tree.command(name="pingme", description="Get pinged when a streamer goes live")
+    @app_commands.guild_only()
+    async def pingme(interaction: discord.Interaction, streamer: str):
+        await run(router, interaction, "!pingme", [streamer])
+
+    @tree.command(name="pingmenot", description="Stop getting pinged when a streamer goes live")
+    @app_commands.guild_only()
+    async def pingmenot(interaction: discord.Interaction, streamer: str):
+        await run(router, interaction, "!pingmenot", [streamer])
+
+    @tree.command(name="addnotifs", description="Add notifications for a streamer to this channel")
+    @app_commands.guild_only()
+    @app_commands.describe(role="Role name or id to ping, 'none' for no role (default: new role)")
+    async def addnotifs(interaction: discord.Interaction, streamer: str, role: str = None):
+        await run(router, interaction, "!addnotifs", [streamer] + (role.split() if role else []))
+
+    @tree.command(name="changemessage", description="Change the going live message for a streamer")
+    @app_commands.guild_only()
+    async def changemessage(interaction: discord.Interaction, streamer: str, message: str):
+        await run(router, interaction, "!changemessage", [streamer] + message.split())
+
+    @tree.command(name="removenotifs", description="Remove notifications for a streamer from this server")
+    @app_commands.guild_only()
+    async def removenotifs(interaction: discord.Interaction, streamer: str, delete_role: bool = False):
+        await run(router, interaction, "!removenotifs", [streamer] + (["-d"] if delete_role else []))
+
+    @tree.command(name="subs", description="List every streamer the bot gets notifications for")
+    @app_commands.guild_only()
+    async def subs(interaction: discord.Interaction):
+        await run(router, interaction, "!subs", [])
+
+    @tree.command(name="clearsubs", description="Delete every Twitch subscription")
+    @app_commands.guild_only()
+    async def clearsubs(interaction: discord.Interaction):
+        await run(router, interaction, "!clearsubs", [])
+
+    @tree.command(name="reconcile", description="Fix Twitch subscriptions now")
+    @app_commands.guild_only()
+    async def reconcile(interaction: discord.Interaction):
+        await run(router, interaction, "!reconcile", [])
+
+    @tree.command(name="queue", description="Show webhook queue stats")
+    @app_commands.guild_only()
+    async def queue(interaction: discord.Interaction):
+        await run(router, interaction, "!queue", [])
+
+    @tree.command(name="cmdstats", description="Show command usage and latency")
+    @app_commands.guild_only()
+    async def cmdstats(interaction: discord.Interaction):
+        await run(router, interaction, "!cmdstats", [])
+
+    @tree.command(name="addmod", description="Make a user a global moderator")
+    @app_commands.guild_only()
+    async def addmod(interaction: discord.Interaction, user: discord.User):
+        await run(router, interaction, "!addmod", [str(user.id)])
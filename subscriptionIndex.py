@@ -0,0 +1,166 @@
+import asyncio
+import logging
+
+def logWriteFailure(task):
+    if not task.cancelled() and task.exception():
+        logging.error("database write failed: %s" % task.exception())
+
+# in-memory copy of the subscription tables, built once at startup
+# reads never touch the database, mutations are written through to it
+# all twitch/discord ids are stored as ints
+class SubscriptionIndex:
+
+    def __init__(self, db):
+        self.db = db
+        # streamer id -> {guild id: DiscordTwitchSubscription}
+        self.streamerSubs = {}
+        # guild id -> set of streamer ids
+        self.guildStreamers = {}
+        # streamer id -> (subscription id, secret) of the active twitch subscription
+        self.activeSubs = {}
+        # streamer id -> id of the last stream seen live
+        self.lastStreams = {}
+        # user ids of global moderators
+        self.globalMods = set()
+
+    async def load(self):
+        subs, activeSubs, lastStreams, globalMods = await asyncio.gather(
+            self.db.loadStreamerSubs(),
+            self.db.loadActiveSubscriptions(),
+            self.db.loadLastStreamIds(),
+            self.db.getGlobalMods())
+        for sub in subs:
+            self.indexSub(sub)
+        for subId, streamerId, secret in activeSubs:
+            self.activeSubs[int(streamerId)] = (subId, secret)
+        for streamerId, streamId in lastStreams:
+            self.lastStreams[int(streamerId)] = str(streamId)
+        self.globalMods = set(int(mod) for mod in globalMods)
+        logging.info("indexed %i subscriptions for %i streamers" % (len(subs), len(self.streamerSubs)))
+
+    def indexSub(self, sub):
+        self.streamerSubs.setdefault(sub.streamerId, {})[sub.guildId] = sub
+        self.guildStreamers.setdefault(sub.guildId, set()).add(sub.streamerId)
+
+    def unindexSub(self, streamerId, guildId):
+        subs = self.streamerSubs.get(streamerId)
+        if subs is not None:
+            subs.pop(guildId, None)
+            if not subs:
+                del self.streamerSubs[streamerId]
+        streamers = self.guildStreamers.get(guildId)
+        if streamers is not None:
+            streamers.discard(streamerId)
+            if not streamers:
+                del self.guildStreamers[guildId]
+
+    # runs a database write without holding up the caller, logging failures
+    def persist(self, coro):
+        task = asyncio.ensure_future(coro)
+        task.add_done_callback(logWriteFailure)
+        return task
+
+    # ---------
+    # reads
+    # ---------
+
+    def getStreamerSubs(self, streamerId):
+        return list(self.streamerSubs.get(int(streamerId), {}).values())
+
+    def findSubscription(self, streamerId, guildId):
+        return self.streamerSubs.get(int(streamerId), {}).get(int(guildId))
+
+    def streamerExists(self, streamerId):
+        return int(streamerId) in self.streamerSubs
+
+    def getAllStreamers(self):
+        return list(self.streamerSubs.keys())
+
+    def getGuildStreamers(self, guildId):
+        return list(self.guildStreamers.get(int(guildId), ()))
+
+    # returns (subscription id, secret) or None
+    def findActiveSubscription(self, streamerId):
+        return self.activeSubs.get(int(streamerId))
+
+    def getLastStreamId(self, streamerId):
+        return self.lastStreams.get(int(streamerId))
+
+    def isGlobalMod(self, userId):
+        return int(userId) in self.globalMods
+
+    # ---------
+    # write-through mutations
+    # ---------
+
+    async def addStreamerSub(self, sub):
+        await self.db.addStreamerSub(sub)
+        self.indexSub(sub)
+
+    async def delSubscription(self, streamerId, guildId):
+        await self.db.delSubscription(streamerId, guildId)
+        self.unindexSub(int(streamerId), int(guildId))
+
+    async def delAllSubscriptions(self, guildId):
+        await self.db.delAllSubscriptions(guildId)
+        for streamerId in self.getGuildStreamers(guildId):
+            self.unindexSub(streamerId, int(guildId))
+
+    # memory is updated first: twitch has already enabled the subscription, so its secret
+    # is needed for the next notification even while (or if) the database write fails
+    async def setActiveSubscription(self, subId, streamerId, secret):
+        self.activeSubs[int(streamerId)] = (subId, secret)
+        await self.db.setActiveSubscription(subId, streamerId, secret)
+
+    # only removes the streamer's active subscription if it is still subId
+    async def delActiveSubscription(self, subId, streamerId):
+        await self.db.delActiveSubscription(subId)
+        active = self.activeSubs.get(int(streamerId))
+        if active is not None and active[0] == subId:
+            del self.activeSubs[int(streamerId)]
+
+    # subs is a list of (subscription id, streamer id), deleted in one transaction
+    async def delActiveSubscriptions(self, subs):
+        await self.db.delActiveSubscriptions([subId for subId, streamerId in subs])
+        for subId, streamerId in subs:
+            active = self.activeSubs.get(int(streamerId))
+            if active is not None and active[0] == subId:
+                del self.activeSubs[int(streamerId)]
+
+    async def clearActiveSubscriptions(self):
+        await self.db.clearActiveSubscriptions()
+        self.activeSubs.clear()
+
+    # memory is updated first so a concurrent duplicate notification is caught immediately
+    # the database write happens in the background
+    def setLastStreamId(self, streamerId, streamId):
+        self.markLive(streamerId, streamId)
+        return self.persist(self.db.setLastStreamId(streamerId, streamId))
+
+    # only updates memory, setLastStreamId saves it
+    def markLive(self, streamerId, streamId):
+        self.lastStreams[int(streamerId)] = str(streamId)
+
+    # undoes markLive, unless another stream was marked since
+    def unmarkLive(self, streamerId, streamId, previousStreamId):
+        if self.lastStreams.get(int(streamerId)) != str(streamId):
+            return
+        if previousStreamId is None:
+            del self.lastStreams[int(streamerId)]
+        else:
+            self.lastStreams[int(streamerId)] = previousStreamId
+
+    # re-reads a streamer's subscriptions after another process changed them
+    async def reloadStreamer(self, streamerId):
+        subs = await self.db.getStreamerSubs(streamerId)
+        for sub in self.getStreamerSubs(streamerId):
+            self.unindexSub(sub.streamerId, sub.guildId)
+        for sub in subs:
+            self.indexSub(sub)
+
+    async def reloadGlobalMods(self):
+        self.globalMods = set(int(mod) for mod in await self.db.getGlobalMods())
+
+    async def addGlobalMod(self, userId):
+        await self.db.addGlobalMod(userId)
+        self.globalMods.add(int(userId))
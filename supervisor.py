@@ -0,0 +1,53 @@
+# starts WORKER_COUNT bot processes and restarts any that exit
+# each worker runs its share of SHARD_COUNT discord shards (see cluster.py)
+import dotenv
+import logging
+import os
+import secrets
+import subprocess
+import sys
+import time
+
+BOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "monkeysPing.py")
+
+def spawn(workerIndex, clusterSecret):
+    env = dict(os.environ, WORKER_INDEX=str(workerIndex), CLUSTER_SECRET=clusterSecret)
+    logging.info("starting worker %i" % workerIndex)
+    return subprocess.Popen([sys.executable, BOT], env=env)
+
+def main():
+    dotenv.load_dotenv(override=True)
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)-8s supervisor: %(message)s',
+        level = logging.INFO,
+        datefmt='%Y-%m-%d %H:%M:%S',
+        filename=os.getenv("LOG_LOCATION"),
+    )
+    workerCount = int(os.getenv("WORKER_COUNT", 1))
+    clusterSecret = secrets.token_urlsafe(32)
+    workers = [spawn(i, clusterSecret) for i in range(workerCount)]
+    started = [time.monotonic()] * workerCount
+    # restarts are delayed more the more often a worker crashes
+    backoff = [1] * workerCount
+    try:
+        while True:
+            time.sleep(1)
+            for i, worker in enumerate(workers):
+                if worker.poll() is None:
+                    continue
+                # ran for a while, so this isn't a crash loop
+                if time.monotonic() - started[i] > 300:
+                    backoff[i] = 1
+                logging.error("worker %i exited with %i, restarting in %is" % (i, worker.returncode, backoff[i]))
+                time.sleep(backoff[i])
+                backoff[i] = min(backoff[i] * 2, 60)
+                workers[i] = spawn(i, clusterSecret)
+                started[i] = time.monotonic()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+
+if __name__ == "__main__":
+    main()
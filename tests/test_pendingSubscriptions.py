@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pendingSubscriptions import PendingSubscriptions
+
+def payload(subId, streamer):
+    return {"id": subId, "condition": {"broadcaster_user_id": str(streamer)}}
+
+class PendingSubscriptionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("pendingSubscriptions.time.monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_and_remove(self):
+        pending = PendingSubscriptions()
+        pending.add(payload("a", 1), "secret")
+        self.assertEqual(pending.get("a"), (payload("a", 1), "secret"))
+        pending.remove("a")
+        self.assertIsNone(pending.get("a"))
+        self.assertEqual(pending.forStreamer(1), [])
+        # removing twice is fine
+        pending.remove("a")
+
+    def test_for_streamer(self):
+        pending = PendingSubscriptions()
+        pending.add(payload("a", 1), "s1")
+        pending.add(payload("b", 1), "s2")
+        pending.add(payload("c", 2), "s3")
+        self.assertEqual(sorted(pending.forStreamer(1)), [("a", "s1"), ("b", "s2")])
+        self.assertEqual(pending.forStreamer(3), [])
+
+    def test_expiry(self):
+        pending = PendingSubscriptions(timeout=600)
+        pending.add(payload("a", 1), "secret")
+        self.now += 300
+        pending.add(payload("b", 2), "secret")
+        self.now += 301
+        self.assertIsNone(pending.get("a"))
+        self.assertEqual(pending.forStreamer(1), [])
+        self.assertIsNotNone(pending.get("b"))
+        self.assertEqual(len(pending), 1)
+        self.now += 300
+        self.assertEqual(len(pending), 0)
+        self.assertEqual(pending.byStreamer, {})
+
+    def test_size_bound(self):
+        pending = PendingSubscriptions(maxSize=3)
+        for i in range(5):
+            pending.add(payload("sub%i" % i, i), "secret")
+        self.assertEqual(len(pending), 3)
+        # oldest dropped first
+        self.assertEqual(list(pending.pending), ["sub2", "sub3", "sub4"])
+        self.assertEqual(sorted(pending.byStreamer), [2, 3, 4])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pingPlanner
+from models.outboxPing import OutboxPing
+
+def ping(guildId, message="$role $link is live", link="https://twitch.tv/a", mention="<@&1>", startedAt=100.0):
+    return OutboxPing(1, guildId, 10, message, link, mention, startedAt)
+
+class PingPlannerTest(unittest.TestCase):
+
+    def test_render(self):
+        self.assertEqual(pingPlanner.render("$role $link is live", "L", "@x"), "@x L is live")
+        self.assertEqual(pingPlanner.render("$role $link is live", "L", None), "L is live")
+
+    def test_can_merge(self):
+        self.assertTrue(pingPlanner.canMerge("$role $link"))
+        self.assertTrue(pingPlanner.canMerge("$link is live $role "))
+        self.assertFalse(pingPlanner.canMerge("$link $role is live"))
+        self.assertFalse(pingPlanner.canMerge("$role $link $role"))
+        self.assertFalse(pingPlanner.canMerge("$link"))
+
+    def test_single_ping(self):
+        text, startedAt, members = pingPlanner.plan([ping(1)])[0]
+        self.assertEqual((text, startedAt, len(members)), ("<@&1> https://twitch.tv/a is live", 100.0, 1))
+
+    def test_mention_merged(self):
+        pings = [ping(1, link="https://twitch.tv/a", startedAt=105.0), ping(2, link="https://twitch.tv/b", startedAt=100.0)]
+        [(text, startedAt, members)] = pingPlanner.plan(pings)
+        self.assertEqual(text, "<@&1> https://twitch.tv/a is live\nhttps://twitch.tv/b is live")
+        self.assertEqual(startedAt, 100.0)
+        self.assertEqual(members, pings)
+
+    def test_other_mentions_kept(self):
+        pings = [ping(1, link="https://twitch.tv/a"), ping(2, link="https://twitch.tv/b", mention="<@&2>")]
+        [(text, startedAt, members)] = pingPlanner.plan(pings)
+        self.assertEqual(text, "<@&1> https://twitch.tv/a is live\n<@&2> https://twitch.tv/b is live")
+
+    def test_mention_inside_template_kept(self):
+        pings = [ping(1, message="$link $role go", link="https://twitch.tv/a"), ping(2, message="$link $role go", link="https://twitch.tv/b")]
+        [(text, startedAt, members)] = pingPlanner.plan(pings)
+        self.assertEqual(text, "https://twitch.tv/a <@&1> go\nhttps://twitch.tv/b <@&1> go")
+
+    def test_duplicate_lines_sent_once(self):
+        pings = [ping(1), ping(2)]
+        [(text, startedAt, members)] = pingPlanner.plan(pings)
+        self.assertEqual(text, "<@&1> https://twitch.tv/a is live")
+        # both pings are delivered by the message
+        self.assertEqual(members, pings)
+
+    def test_split_at_length_limit(self):
+        pings = [ping(i, message="$link " + "x" * 900, link="https://twitch.tv/%i" % i) for i in range(5)]
+        messages = pingPlanner.plan(pings)
+        self.assertEqual([len(members) for text, startedAt, members in messages], [2, 2, 1])
+        for text, startedAt, members in messages:
+            self.assertLessEqual(len(text), pingPlanner.MAX_LENGTH)
+        self.assertEqual(sum((members for text, startedAt, members in messages), []), pings)
+
+    def test_no_pings(self):
+        self.assertEqual(pingPlanner.plan([]), [])
+
+if __name__ == "__main__":
+    unittest.main()
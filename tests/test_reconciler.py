@@ -0,0 +1,98 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import twitchClient
+from pendingSubscriptions import PendingSubscriptions
+from reconciler import Reconciler
+
+def twitchSub(subId, streamer, status="enabled"):
+    return {"id": subId, "status": status, "type": "stream.online", "condition": {"broadcaster_user_id": str(streamer)}}
+
+class FakeApi:
+    def __init__(self, subs, failAfter=None):
+        self.subs = subs
+        self.failAfter = failAfter
+
+    async def iterSubscriptions(self, status=None, type=None):
+        for i, sub in enumerate(self.subs):
+            if self.failAfter is not None and i == self.failAfter:
+                raise twitchClient.TwitchError("fetching eventsub subscriptions failed", 500)
+            yield sub
+
+class FakeIndex:
+    def __init__(self, streamers, activeSubs):
+        self.streamers = streamers
+        self.activeSubs = activeSubs
+
+    def getAllStreamers(self):
+        return list(self.streamers)
+
+    def findActiveSubscription(self, streamerId):
+        return self.activeSubs.get(int(streamerId))
+
+class ReconcilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pending = PendingSubscriptions()
+        self.cleared = []
+        self.registered = []
+
+    def reconciler(self, subs, streamers, activeSubs, failAfter=None):
+        async def clearSubs(subs):
+            self.cleared.extend(subs)
+        async def registerSubs(streamers):
+            self.registered.extend(streamers)
+        return Reconciler(FakeApi(subs, failAfter), FakeIndex(streamers, activeSubs), self.pending, clearSubs, registerSubs)
+
+    def diff(self, subs, streamers, activeSubs):
+        toDelete, toRegister = asyncio.run(self.reconciler(subs, streamers, activeSubs).diff())
+        return [sub['id'] for sub in toDelete], toRegister
+
+    def test_keeps_active_subscription(self):
+        self.assertEqual(self.diff([twitchSub("a", 1)], {1}, {1: ("a", "secret")}), ([], set()))
+
+    def test_deletes_subscription_without_secret(self):
+        # enabled on twitch but the index holds another subscription's secret
+        self.assertEqual(self.diff([twitchSub("a", 1)], {1}, {1: ("b", "secret")}), (["a"], {1}))
+
+    def test_deletes_streamer_nobody_follows(self):
+        self.assertEqual(self.diff([twitchSub("a", 1)], set(), {1: ("a", "secret")}), (["a"], set()))
+
+    def test_deletes_duplicates(self):
+        subs = [twitchSub("a", 1), twitchSub("b", 1)]
+        self.assertEqual(self.diff(subs, {1}, {1: ("a", "secret")}), (["b"], set()))
+        # both usable, the first one listed is kept
+        self.pending.add(twitchSub("c", 2, "webhook_callback_verification_pending"), "secret")
+        subs = [twitchSub("d", 2), twitchSub("c", 2, "webhook_callback_verification_pending")]
+        self.assertEqual(self.diff(subs, {2}, {2: ("d", "secret")}), (["c"], set()))
+
+    def test_pending_kept_only_while_registered(self):
+        self.pending.add(twitchSub("a", 1, "webhook_callback_verification_pending"), "secret")
+        subs = [twitchSub("a", 1, "webhook_callback_verification_pending"), twitchSub("b", 2, "webhook_callback_verification_pending")]
+        self.assertEqual(self.diff(subs, {1, 2}, {}), (["b"], {2}))
+
+    def test_deletes_failed_subscriptions(self):
+        subs = [twitchSub("a", 1, "authorization_revoked"), twitchSub("b", 2, "notification_failures_exceeded")]
+        self.assertEqual(self.diff(subs, {1, 2}, {1: ("a", "secret")}), (["a", "b"], {1, 2}))
+
+    def test_registers_missing_streamers(self):
+        self.assertEqual(self.diff([], {1, 2}, {}), ([], {1, 2}))
+
+    def test_run_applies_difference(self):
+        reconciler = self.reconciler([twitchSub("a", 1), twitchSub("b", 3)], {1, 2}, {1: ("a", "secret")})
+        self.assertEqual(asyncio.run(reconciler.run()), (1, 1))
+        self.assertEqual([sub['id'] for sub in self.cleared], ["b"])
+        self.assertEqual(self.registered, [2])
+
+    def test_run_aborts_on_partial_listing(self):
+        reconciler = self.reconciler([twitchSub("a", 1), twitchSub("b", 3)], {1, 2}, {}, failAfter=1)
+        self.assertIsNone(asyncio.run(reconciler.run()))
+        self.assertEqual(self.cleared, [])
+        self.assertEqual(self.registered, [])
+
+if __name__ == "__main__":
+    unittest.main()
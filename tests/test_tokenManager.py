@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import twitchClient
+from tokenManager import TokenManager, UserTokenManager
+
+class FakeResponse:
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+# oauth stand-in, each token request takes a moment so concurrent callers overlap
+class FakeApi:
+    def __init__(self, status=200):
+        self.status = status
+        self.requests = 0
+
+    async def requestAppToken(self, clientSecret):
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        return FakeResponse(self.status, {"access_token": "token%i" % self.requests, "expires_in": 5000})
+
+    async def refreshUserToken(self, clientSecret, refreshToken):
+        self.requests += 1
+        await asyncio.sleep(0.01)
+        return FakeResponse(self.status, {"access_token": "user%i" % self.requests, "refresh_token": "refresh%i" % self.requests, "expires_in": 5000})
+
+class TokenManagerTest(unittest.TestCase):
+
+    def test_concurrent_callers_share_one_refresh(self):
+        async def scenario():
+            api = FakeApi()
+            tokens = TokenManager(api, "secret")
+            return await asyncio.gather(*[tokens.getToken() for i in range(10)]), api.requests
+        found, requests = asyncio.run(scenario())
+        self.assertEqual(found, ["token1"] * 10)
+        self.assertEqual(requests, 1)
+
+    def test_stale_token_refreshed_once(self):
+        async def scenario():
+            api = FakeApi()
+            tokens = TokenManager(api, "secret")
+            stale = await tokens.getToken()
+            # every caller got a 401 with the same token
+            renewed = await asyncio.gather(*[tokens.refresh(stale) for i in range(10)])
+            # a caller still holding the old token gets the new one without another request
+            late = await tokens.refresh(stale)
+            return renewed, late, api.requests
+        renewed, late, requests = asyncio.run(scenario())
+        self.assertEqual(renewed, ["token2"] * 10)
+        self.assertEqual(late, "token2")
+        self.assertEqual(requests, 2)
+
+    def test_failed_refresh_raises_for_every_caller(self):
+        async def scenario():
+            api = FakeApi(status=500)
+            tokens = TokenManager(api, "secret")
+            return await asyncio.gather(*[tokens.getToken() for i in range(3)], return_exceptions=True), api.requests
+        results, requests = asyncio.run(scenario())
+        self.assertEqual([type(result) for result in results], [twitchClient.TwitchError] * 3)
+        self.assertEqual(requests, 1)
+
+    def test_user_token_refresh(self):
+        async def scenario():
+            api = FakeApi()
+            tokens = UserTokenManager(api, "secret", "configured", "refresh0")
+            first = await tokens.getToken()
+            renewed = await asyncio.gather(tokens.refresh(first), tokens.refresh(first))
+            return first, renewed, tokens.refreshToken, api.requests
+        first, renewed, refreshToken, requests = asyncio.run(scenario())
+        self.assertEqual(first, "configured")
+        self.assertEqual(renewed, ["user1", "user1"])
+        self.assertEqual(refreshToken, "refresh1")
+        self.assertEqual(requests, 1)
+
+    def test_user_token_without_refresh_token(self):
+        async def scenario():
+            tokens = UserTokenManager(FakeApi(), "secret", "configured")
+            await tokens.refresh("configured")
+        with self.assertRaises(twitchClient.TwitchError) as raised:
+            asyncio.run(scenario())
+        self.assertEqual(raised.exception.status, 401)
+
+if __name__ == "__main__":
+    unittest.main()
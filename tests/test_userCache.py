@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userCache import UserCache
+
+class FakeResponse:
+    def __init__(self, data, status=200):
+        self.status = status
+        self.data = data
+
+    @property
+    def ok(self):
+        return True
+
+# helix stand-in that answers /users after a delay, so lookups can arrive mid-fetch
+class FakeApi:
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+
+    async def get(self, path, params=None):
+        self.calls.append(params)
+        await asyncio.sleep(self.delay)
+        users = [{"id": value, "login": "user" + value, "display_name": "User" + value} for key, value in params if key == "id"]
+        return FakeResponse({"data": users})
+
+class UserCacheTest(unittest.TestCase):
+
+    def test_miss_during_fetch(self):
+        async def scenario():
+            api = FakeApi(0.05)
+            users = UserCache(api, batchDelay=0.01)
+            first = asyncio.ensure_future(users.getById(1))
+            # past the batch delay, the request for id 1 is in flight
+            await asyncio.sleep(0.03)
+            second = await asyncio.wait_for(users.getById(2), 1)
+            return await first, second, api.calls
+        first, second, calls = asyncio.run(scenario())
+        self.assertEqual(first.id, 1)
+        self.assertEqual(second.id, 2)
+        self.assertEqual(calls, [[("id", "1")], [("id", "2")]])
+
+    def test_concurrent_misses_share_a_request(self):
+        async def scenario():
+            api = FakeApi(0)
+            users = UserCache(api)
+            found = await asyncio.gather(users.getById(1), users.getById(2), users.getByLogin("user3"))
+            return found, api.calls
+        found, calls = asyncio.run(scenario())
+        self.assertEqual([user.id for user in found[:2]], [1, 2])
+        self.assertIsNone(found[2])
+        self.assertEqual(len(calls), 1)
+
+    def test_get_by_id_or_login(self):
+        async def scenario():
+            api = FakeApi(0)
+            users = UserCache(api)
+            return await users.get("42"), await users.get("someone"), api.calls
+        byId, byLogin, calls = asyncio.run(scenario())
+        self.assertEqual(byId.id, 42)
+        self.assertIsNone(byLogin)
+        self.assertEqual(calls, [[("id", "42")], [("login", "someone")]])
+
+    def test_failed_fetch_resolves_to_none(self):
+        class EmptyApi:
+            async def get(self, path, params=None):
+                return FakeResponse(None, status=204)
+        class BrokenApi:
+            async def get(self, path, params=None):
+                raise RuntimeError("connection reset")
+        async def scenario(api):
+            users = UserCache(api)
+            return await asyncio.wait_for(asyncio.gather(users.getById(1), users.getByLogin("someone")), 1), users
+        for api in (EmptyApi(), BrokenApi()):
+            found, users = asyncio.run(scenario(api))
+            self.assertEqual(found, [None, None])
+            # failures aren't cached
+            self.assertEqual(users.cached(users.byId, 1), (False, None))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+import twitchClient
+
+# keeps a valid twitch app access token
+# the token is refreshed in the background before it expires and validated every hour
+# (as twitch requires), refreshes are single-flight so any number of callers that
+# hit a 401 at the same time share one request to the oauth endpoint
+class TokenManager:
+
+    def __init__(self, api, clientSecret, refreshMargin=3600, checkInterval=3600):
+        self.api = api
+        self.clientSecret = clientSecret
+        # refresh this many seconds before the token expires
+        self.refreshMargin = refreshMargin
+        self.checkInterval = checkInterval
+        self.token = None
+        self.expiresAt = 0
+        self.refreshing = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_event_loop().create_task(self.run())
+
+    async def getToken(self):
+        if self.token is None or self.expiresAt <= time.time():
+            return await self.refresh(self.token)
+        return self.token
+
+    # replaces staleToken with a new one
+    # returns straight away if another caller already replaced it
+    async def refresh(self, staleToken=None):
+        if self.token is not None and self.token != staleToken:
+            return self.token
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self.fetch())
+        return await asyncio.shield(self.refreshing)
+
+    async def fetch(self):
+        req = await self.api.requestAppToken(self.clientSecret)
+        if (not req.ok):
+            raise twitchClient.TwitchError("renewing twitch token failed", req.status)
+        self.token = req.data['access_token']
+        self.expiresAt = time.time() + req.data['expires_in']
+        logging.info("twitch token renewed, expires in %is" % req.data['expires_in'])
+        return self.token
+
+    async def validate(self):
+        req = await self.api.validateToken(self.token)
+        if (req.status == 401):
+            logging.info("twitch token no longer valid")
+            await self.refresh(self.token)
+        elif (req.ok):
+            self.expiresAt = time.time() + req.data['expires_in']
+
+    async def run(self):
+        while True:
+            try:
+                if self.token is None or self.expiresAt - time.time() < self.refreshMargin:
+                    await self.refresh(self.token)
+                else:
+                    await self.validate()
+            except twitchClient.TwitchError as e:
+                logging.error(str(e))
+            wait = min(self.checkInterval, self.expiresAt - self.refreshMargin - time.time())
+            await asyncio.sleep(max(wait, 60))
+
+# a user access token, needed to create eventsub websocket subscriptions
+# (twitch only accepts app tokens for webhooks)
+# starts from the configured token, which is validated like the app token, and is
+# renewed with the refresh token (if set) once twitch rejects it or it is about to expire
+class UserTokenManager(TokenManager):
+
+    def __init__(self, api, clientSecret, token, refreshToken=None, **kwargs):
+        super().__init__(api, clientSecret, **kwargs)
+        self.token = token
+        self.refreshToken = refreshToken
+        # unknown until the first validation
+        self.expiresAt = float('inf')
+
+    async def fetch(self):
+        if not self.refreshToken:
+            raise twitchClient.TwitchError("twitch user token rejected and no refresh token set", 401)
+        req = await self.api.refreshUserToken(self.clientSecret, self.refreshToken)
+        if (not req.ok):
+            raise twitchClient.TwitchError("renewing twitch user token failed", req.status)
+        self.token = req.data['access_token']
+        # twitch may hand out a new refresh token with every refresh
+        self.refreshToken = req.data.get('refresh_token', self.refreshToken)
+        self.expiresAt = time.time() + req.data['expires_in']
+        logging.info("twitch user token renewed, expires in %is" % req.data['expires_in'])
+        return self.token
@@ -0,0 +1,189 @@
+import aiohttp
+import asyncio
+import datetime
+import logging
+import metrics
+import time
+import urllib.parse as urlp
+
+# result of a twitch api call
+# status is 0 if the request never got a response (timeout, connection error)
+class TwitchResponse:
+    def __init__(self, status, data, headers):
+        self.status = status
+        self.data = data
+        self.headers = headers
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+# raised when a twitch request that can't be partially handled fails
+class TwitchError(Exception):
+    def __init__(self, message, status):
+        super().__init__("%s (%i)" % (message, status))
+        self.status = status
+
+# shared async client for the twitch helix/eventsub and oauth apis
+# one aiohttp session is reused so keep-alive connections are pooled between calls
+class TwitchClient:
+
+    def __init__(self, clientId, apiUrl="https://api.twitch.tv/helix", authUrl="https://id.twitch.tv/oauth2", timeout=10, maxConnections=20):
+        self.clientId = clientId
+        self.apiUrl = apiUrl
+        self.authUrl = authUrl
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.maxConnections = maxConnections
+        # TokenManager providing the app access token for helix requests
+        self.tokens = None
+        self.session = None
+        # helix rate limit bucket, from the Ratelimit-* headers of the last response
+        # requests wait for the bucket to refill once fewer than rateReserve points are left
+        self.rateReserve = 5
+        self.rateRemaining = None
+        self.rateReset = 0
+
+    # session is created lazily so it binds to the running event loop
+    def getSession(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.maxConnections, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def authHeaders(self, token):
+        header = {"Client-ID": self.clientId}
+        if token:
+            header['Authorization'] = 'Bearer ' + token
+        return header
+
+    # waits for the rate limit bucket to refill if it is nearly empty
+    async def throttle(self):
+        if self.rateRemaining is not None and self.rateRemaining <= self.rateReserve:
+            wait = self.rateReset - time.time()
+            if wait > 0:
+                logging.info("twitch rate limit nearly used, waiting %.1fs" % wait)
+                await asyncio.sleep(wait)
+            self.rateRemaining = None
+        elif self.rateRemaining is not None:
+            # count this request against the bucket until the response updates it
+            self.rateRemaining -= 1
+
+    def updateRateLimit(self, headers):
+        remaining = headers.get('Ratelimit-Remaining')
+        reset = headers.get('Ratelimit-Reset')
+        if remaining is not None and reset is not None:
+            self.rateRemaining = int(remaining)
+            self.rateReset = int(reset)
+
+    # sends a request to a full url and parses the json response (if any)
+    async def send(self, method, url, params, json, headers):
+        await self.throttle()
+        resp = TwitchResponse(0, None, {})
+        start = time.perf_counter()
+        try:
+            async with self.getSession().request(method, url, params=params, json=json, headers=headers) as r:
+                self.updateRateLimit(r.headers)
+                data = None
+                if r.content_type == 'application/json':
+                    data = await r.json()
+                resp = TwitchResponse(r.status, data, r.headers)
+        except asyncio.TimeoutError:
+            logging.error("twitch %s %s timed out" % (method, url))
+        except aiohttp.ClientError as e:
+            logging.error("twitch %s %s failed: %s" % (method, url, e))
+        # label by path only, ids are passed as params so this stays low cardinality
+        path = urlp.urlsplit(url).path
+        metrics.twitchSeconds.observe(time.perf_counter() - start, method, path)
+        metrics.twitchRequests.inc(method, path, str(resp.status))
+        return resp
+
+    # retries rate limited (429), server error and failed requests up to retries times
+    # rate limited requests wait for the bucket reset, others back off exponentially
+    async def retry(self, method, url, params, json, headers, retries):
+        for attempt in range(retries + 1):
+            resp = await self.send(method, url, params, json, headers)
+            if resp.status != 429 and resp.status != 0 and resp.status < 500:
+                return resp
+            if attempt == retries:
+                break
+            if resp.status == 429:
+                wait = max(self.rateReset - time.time(), 1)
+            else:
+                wait = 2 ** attempt
+            logging.info("twitch %s %s returned %i, retrying in %.1fs" % (method, url, resp.status, wait))
+            await asyncio.sleep(wait)
+        return resp
+
+    # requests without explicit headers are authorized with the app access token
+    # (or the token of another TokenManager given as tokens)
+    # a 401 refreshes the token once (shared with any other caller that got one) and tries again
+    async def request(self, method, url, params=None, json=None, headers=None, retries=0, tokens=None):
+        tokens = tokens or self.tokens
+        if headers is not None or tokens is None:
+            return await self.retry(method, url, params, json, headers or self.authHeaders(None), retries)
+        try:
+            token = await tokens.getToken()
+            resp = await self.retry(method, url, params, json, self.authHeaders(token), retries)
+            if resp.status == 401:
+                token = await tokens.refresh(token)
+                resp = await self.retry(method, url, params, json, self.authHeaders(token), retries)
+            return resp
+        except TwitchError as e:
+            logging.error("twitch %s %s not sent: %s" % (method, url, e))
+            return TwitchResponse(e.status, None, {})
+
+    # helix endpoints, path relative to the api url
+    async def get(self, path, params=None, retries=0, tokens=None):
+        return await self.request("GET", self.apiUrl + path, params=params, retries=retries, tokens=tokens)
+
+    async def post(self, path, json=None, retries=0, tokens=None):
+        return await self.request("POST", self.apiUrl + path, json=json, retries=retries, tokens=tokens)
+
+    async def delete(self, path, params=None, retries=0, tokens=None):
+        return await self.request("DELETE", self.apiUrl + path, params=params, retries=retries, tokens=tokens)
+
+    # yields every eventsub subscription, following the pagination cursor page by page
+    # helix accepts only one filter per request, so when both are given status is
+    # filtered by twitch and type is filtered here
+    async def iterSubscriptions(self, status=None, type=None):
+        params = {}
+        if status:
+            params['status'] = status
+        elif type:
+            params['type'] = type
+        while True:
+            req = await self.get("/eventsub/subscriptions", params=params)
+            if (not req.ok):
+                raise TwitchError("fetching eventsub subscriptions failed", req.status)
+            for sub in req.data['data']:
+                if type and sub['type'] != type:
+                    continue
+                yield sub
+            cursor = req.data.get('pagination', {}).get('cursor')
+            if not cursor:
+                return
+            params['after'] = cursor
+
+    # oauth endpoints
+    async def validateToken(self, token):
+        return await self.request("GET", self.authUrl + "/validate", headers={"Authorization": "OAuth " + token})
+
+    async def requestAppToken(self, clientSecret):
+        params = {"client_id": self.clientId, "client_secret": clientSecret, "grant_type": "client_credentials"}
+        return await self.request("POST", self.authUrl + "/token", params=params, headers={})
+
+    async def refreshUserToken(self, clientSecret, refreshToken):
+        params = {"client_id": self.clientId, "client_secret": clientSecret, "grant_type": "refresh_token", "refresh_token": refreshToken}
+        return await self.request("POST", self.authUrl + "/token", params=params, headers={})
+
+# converts a twitch RFC3339 timestamp (nanosecond precision, Z suffix) to epoch seconds
+def parseTimestamp(timestamp):
+    date, _, fraction = timestamp.rstrip('Z').partition('.')
+    seconds = datetime.datetime.strptime(date, "%Y-%m-%dT%H:%M:%S").replace(tzinfo=datetime.timezone.utc).timestamp()
+    if fraction:
+        seconds += float("0." + fraction)
+    return seconds
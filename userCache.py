@@ -0,0 +1,127 @@
+import asyncio
+import collections
+import logging
+import time
+from models.twitchUser import TwitchUser
+
+# helix accepts at most 100 ids/logins per users request
+BATCH_SIZE = 100
+
+# caches twitch users by id and by login
+# lookups that miss are collected for a short moment and resolved together
+# in batched helix requests, users that don't exist are cached too (for a shorter time)
+class UserCache:
+
+    def __init__(self, api, maxSize=5000, ttl=3600, negativeTtl=300, batchDelay=0.01):
+        self.api = api
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.negativeTtl = negativeTtl
+        self.batchDelay = batchDelay
+        # key -> (TwitchUser or None, expiry), least recently used first
+        self.byId = collections.OrderedDict()
+        self.byLogin = collections.OrderedDict()
+        # misses waiting for the next batch, key -> future
+        self.pendingIds = {}
+        self.pendingLogins = {}
+        self.flushTask = None
+
+    def cached(self, table, key):
+        entry = table.get(key)
+        if entry is None:
+            return False, None
+        user, expiry = entry
+        if expiry < time.monotonic():
+            del table[key]
+            return False, None
+        table.move_to_end(key)
+        return True, user
+
+    def store(self, table, key, user):
+        table[key] = (user, time.monotonic() + (self.ttl if user else self.negativeTtl))
+        table.move_to_end(key)
+        while len(table) > self.maxSize:
+            table.popitem(last=False)
+
+    def queue(self, pending, key):
+        future = pending.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            pending[key] = future
+            if self.flushTask is None or self.flushTask.done():
+                self.flushTask = asyncio.ensure_future(self.flush())
+        return future
+
+    # resolves all queued misses, BATCH_SIZE ids+logins per request
+    # misses queued while the requests are running are picked up by the next round
+    async def flush(self):
+        while self.pendingIds or self.pendingLogins:
+            await asyncio.sleep(self.batchDelay)
+            requests = []
+            while self.pendingIds or self.pendingLogins:
+                ids = {}
+                logins = {}
+                while self.pendingIds and len(ids) < BATCH_SIZE:
+                    key, future = self.pendingIds.popitem()
+                    ids[key] = future
+                while self.pendingLogins and len(ids) + len(logins) < BATCH_SIZE:
+                    key, future = self.pendingLogins.popitem()
+                    logins[key] = future
+                requests.append(self.fetch(ids, logins))
+            await asyncio.gather(*requests)
+
+    # every future of the batch is resolved, to None if the request failed
+    async def fetch(self, ids, logins):
+        try:
+            params = [("id", str(key)) for key in ids] + [("login", key) for key in logins]
+            req = await self.api.get("/users", params=params)
+            if (not req.ok or not req.data):
+                # don't cache failures, let the next lookup try again
+                logging.error("ERROR FETCHING USERS (%i)" % req.status)
+                return
+            found = [TwitchUser(user['id'], user['login'], user['display_name']) for user in req.data['data']]
+            for user in found:
+                self.store(self.byId, user.id, user)
+                self.store(self.byLogin, user.login, user)
+            foundIds = {user.id: user for user in found}
+            foundLogins = {user.login: user for user in found}
+            for key, future in ids.items():
+                if key not in foundIds:
+                    self.store(self.byId, key, None)
+                if not future.done():
+                    future.set_result(foundIds.get(key))
+            for key, future in logins.items():
+                if key not in foundLogins:
+                    self.store(self.byLogin, key, None)
+                if not future.done():
+                    future.set_result(foundLogins.get(key))
+        except Exception:
+            logging.exception("fetching users failed")
+        finally:
+            for future in list(ids.values()) + list(logins.values()):
+                if not future.done():
+                    future.set_result(None)
+
+    # returns TwitchUser or None
+    async def getById(self, userId):
+        hit, user = self.cached(self.byId, int(userId))
+        if hit:
+            return user
+        return await self.queue(self.pendingIds, int(userId))
+
+    async def getByLogin(self, login):
+        hit, user = self.cached(self.byLogin, login.lower())
+        if hit:
+            return user
+        return await self.queue(self.pendingLogins, login.lower())
+
+    # an all-digit argument is a user id, anything else a login
+    async def get(self, idOrLogin):
+        if str(idOrLogin).isdigit():
+            return await self.getById(idOrLogin)
+        return await self.getByLogin(idOrLogin)
+
+    # returns the users that exist, in no particular order
+    async def getUsersById(self, userIds):
+        users = await asyncio.gather(*[self.getById(userId) for userId in userIds])
+        return [user for user in users if user]
@@ -0,0 +1,39 @@
+import collections
+import hashlib
+import hmac
+
+# checks the signature twitch puts on every eventsub webhook message:
+# sha256 hmac keyed with the subscription's secret over message id + timestamp + body
+# the hmac keyed with each secret is kept (least recently used dropped past maxSize)
+# and copied per request, the pieces are fed in one at a time instead of being
+# concatenated and the result is compared in constant time
+class SignatureVerifier:
+
+    def __init__(self, maxSize=10000):
+        self.maxSize = maxSize
+        # secret -> hmac keyed with it
+        self.keyed = collections.OrderedDict()
+
+    def keyedMac(self, secret):
+        mac = self.keyed.get(secret)
+        if mac is None:
+            mac = hmac.new(secret.encode('utf-8'), digestmod=hashlib.sha256)
+            self.keyed[secret] = mac
+            if len(self.keyed) > self.maxSize:
+                self.keyed.popitem(last=False)
+        else:
+            self.keyed.move_to_end(secret)
+        return mac
+
+    # returns True if signature ("sha256=<hex digest>") is right for the message
+    def verify(self, secret, messageId, timestamp, body, signature):
+        if not signature.startswith("sha256=") or messageId is None or timestamp is None:
+            return False
+        mac = self.keyedMac(secret).copy()
+        mac.update(messageId.encode('utf-8'))
+        mac.update(timestamp.encode('utf-8'))
+        mac.update(body)
+        return hmac.compare_digest(mac.hexdigest().encode('ascii'), signature[7:].encode('utf-8'))
+
+    def forget(self, secret):
+        self.keyed.pop(secret, None)
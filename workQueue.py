@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import metrics
+import time
+
+# bounded in-process queue of coroutine jobs drained by a fixed pool of workers
+# lets the webhook handler respond to twitch before doing the slow work
+class WorkQueue:
+
+    def __init__(self, maxSize=1000, workers=4):
+        self.queue = asyncio.Queue(maxsize=maxSize)
+        self.workerCount = workers
+        self.workers = []
+        # stats
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.lastWait = 0.0
+        self.maxWait = 0.0
+        self.totalWait = 0.0
+
+    def start(self):
+        loop = asyncio.get_event_loop()
+        for i in range(self.workerCount):
+            self.workers.append(loop.create_task(self.worker()))
+
+    # queues job(*args) to be run by a worker
+    # returns False if the queue is full
+    def submit(self, job, *args):
+        try:
+            self.queue.put_nowait((time.monotonic(), job, args))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logging.error("work queue full, rejecting %s" % job.__name__)
+            return False
+        return True
+
+    async def worker(self):
+        while True:
+            queuedAt, job, args = await self.queue.get()
+            wait = time.monotonic() - queuedAt
+            self.lastWait = wait
+            self.maxWait = max(self.maxWait, wait)
+            self.totalWait += wait
+            metrics.queueWait.observe(wait)
+            try:
+                await job(*args)
+            except Exception:
+                self.failed += 1
+                logging.exception("queued job %s failed" % job.__name__)
+            finally:
+                self.processed += 1
+                self.queue.task_done()
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "lastWait": self.lastWait,
+            "maxWait": self.maxWait,
+            "avgWait": self.totalWait / self.processed if self.processed else 0.0,
+        }